@@ -0,0 +1,81 @@
+"""Compact consumer representations used between MCP decode and notification.
+
+ConsumerRecord is a __slots__ object (no per-instance dict) that still supports
+consumer['avg_kwh'] item access, so prompt and letter code can take either a record or a
+plain dict. ConsumerTable keeps a decoded MCP chunk as columns: interned
+consumer_id strings plus NumPy arrays for the numeric and flag columns.
+"""
+
+import sys
+
+import numpy as np
+
+FIELDS = ("consumer_id", "avg_kwh", "uses_efficient_equipment", "produces_solar")
+
+
+class ConsumerRecord:
+    __slots__ = FIELDS
+
+    def __init__(self, consumer_id, avg_kwh, uses_efficient_equipment, produces_solar):
+        self.consumer_id = consumer_id
+        self.avg_kwh = avg_kwh
+        self.uses_efficient_equipment = uses_efficient_equipment
+        self.produces_solar = produces_solar
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in FIELDS else default
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in FIELDS)
+        return f"ConsumerRecord({fields})"
+
+
+class ConsumerTable:
+    """Columnar consumers: `consumer_id` list plus `avg_kwh` (float64), `efficient` and
+    `solar` (bool) arrays of the same length."""
+
+    __slots__ = ("consumer_id", "avg_kwh", "efficient", "solar")
+
+    def __init__(self, consumer_id, avg_kwh, efficient, solar):
+        self.consumer_id = [sys.intern(c) for c in consumer_id]
+        self.avg_kwh = np.asarray(avg_kwh, dtype=np.float64)
+        self.efficient = np.asarray(efficient, dtype=bool)
+        self.solar = np.asarray(solar, dtype=bool)
+
+    @classmethod
+    def from_payload(cls, data):
+        """Table from an MCP summary payload in either layout (columnar dict or list of rows)."""
+        if isinstance(data, dict):
+            return cls(
+                data["consumer_id"],
+                data["avg_kwh"],
+                data["uses_efficient_equipment"],
+                data["produces_solar"],
+            )
+        n = len(data)
+        return cls(
+            [c["consumer_id"] for c in data],
+            np.fromiter((c["avg_kwh"] for c in data), dtype=np.float64, count=n),
+            np.fromiter((c["uses_efficient_equipment"] for c in data), dtype=bool, count=n),
+            np.fromiter((c["produces_solar"] for c in data), dtype=bool, count=n),
+        )
+
+    def __len__(self):
+        return len(self.consumer_id)
+
+    def __iter__(self):
+        # tolist() converts each column to Python scalars in one pass instead of per element
+        for row in zip(
+            self.consumer_id, self.avg_kwh.tolist(), self.efficient.tolist(), self.solar.tolist()
+        ):
+            yield ConsumerRecord(*row)
+
+    def columns(self):
+        """(avg_kwh, efficient, solar) arrays, as discounts.classify_batch takes them."""
+        return self.avg_kwh, self.efficient, self.solar
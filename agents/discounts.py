@@ -0,0 +1,99 @@
+"""Discount scenario classification, per consumer and vectorized over whole neighbourhoods."""
+
+import numpy as np
+
+from agents.scenarios import SCENARIOS, USAGE_THRESHOLD_KWH
+
+SCENARIO_CODES = {name: code for code, name in enumerate(SCENARIOS)}
+
+# Discount (percent) granted per scenario
+DISCOUNT_TIERS = {
+    "10_percent": 10,
+    "5_percent_efficient": 5,
+    "5_percent_solar": 5,
+    "no_discount_low_usage": 0,
+    "high_usage": 0,
+}
+
+
+def classify(avg_kwh, uses_efficient, produces_solar, usage_threshold=USAGE_THRESHOLD_KWH):
+    """Scenario name for a single consumer."""
+    if avg_kwh < usage_threshold:
+        if uses_efficient and produces_solar:
+            return "10_percent"
+        elif uses_efficient:
+            return "5_percent_efficient"
+        elif produces_solar:
+            return "5_percent_solar"
+        else:
+            return "no_discount_low_usage"
+    else:
+        return "high_usage"
+
+
+def classify_codes(avg_kwh, uses_efficient, produces_solar, usage_threshold=USAGE_THRESHOLD_KWH):
+    """Vectorized classify(): returns an int8 array of indices into SCENARIOS.
+
+    Inputs broadcast against each other, so passing thresholds shaped (V, 1) with
+    consumer arrays shaped (N,) classifies every consumer under V threshold variants.
+    """
+    avg_kwh = np.asarray(avg_kwh, dtype=np.float64)
+    efficient = np.asarray(uses_efficient, dtype=bool)
+    solar = np.asarray(produces_solar, dtype=bool)
+    # low usage: 3 - 2*efficient - solar maps to 0 (both), 1 (efficient), 2 (solar), 3 (neither)
+    low_code = 3 - 2 * efficient.astype(np.int8) - solar.astype(np.int8)
+    return np.where(avg_kwh < usage_threshold, low_code, SCENARIO_CODES["high_usage"]).astype(
+        np.int8
+    )
+
+
+def count_codes(codes):
+    """Scenario name -> number of consumers, for a 1-D code array."""
+    counts = np.bincount(np.asarray(codes).ravel(), minlength=len(SCENARIOS))
+    return {name: int(counts[code]) for code, name in enumerate(SCENARIOS)}
+
+
+def classify_batch(avg_kwh, uses_efficient, produces_solar, usage_threshold=USAGE_THRESHOLD_KWH):
+    """Classify a whole batch in one pass; returns (codes, counts)."""
+    codes = classify_codes(avg_kwh, uses_efficient, produces_solar, usage_threshold)
+    return codes, count_codes(codes)
+
+
+def classify_variants(avg_kwh, uses_efficient, produces_solar, usage_thresholds):
+    """Scenario counts for each threshold variant: an int array shaped (V, len(SCENARIOS)).
+
+    Memory is V x N bytes for the intermediate codes, so very large sweeps should be
+    fed in consumer chunks and the results summed.
+    """
+    thresholds = np.asarray(usage_thresholds, dtype=np.float64).reshape(-1, 1)
+    codes = classify_codes(avg_kwh, uses_efficient, produces_solar, thresholds)
+    n_variants = thresholds.shape[0]
+    # offset each variant's codes into its own bin range so one bincount covers them all
+    offsets = (np.arange(n_variants) * len(SCENARIOS)).reshape(-1, 1)
+    flat = np.bincount((codes + offsets).ravel(), minlength=n_variants * len(SCENARIOS))
+    return flat.reshape(n_variants, len(SCENARIOS))
+
+
+def discount_percents(codes, tiers=None):
+    """Discount percent per consumer for a code array, using `tiers` (defaults to DISCOUNT_TIERS)."""
+    tiers = DISCOUNT_TIERS if tiers is None else tiers
+    table = np.array([tiers.get(name, 0) for name in SCENARIOS], dtype=np.float64)
+    return table[np.asarray(codes)]
+
+
+def consumer_columns(consumers):
+    """(avg_kwh, efficient, solar) arrays from a ConsumerTable, a columnar payload or a
+    list of consumer dicts/records."""
+    if hasattr(consumers, "columns"):
+        return consumers.columns()
+    if isinstance(consumers, dict):
+        return (
+            np.asarray(consumers["avg_kwh"], dtype=np.float64),
+            np.asarray(consumers["uses_efficient_equipment"], dtype=bool),
+            np.asarray(consumers["produces_solar"], dtype=bool),
+        )
+    n = len(consumers)
+    avg_kwh = np.fromiter((c["avg_kwh"] for c in consumers), dtype=np.float64, count=n)
+    efficient = np.fromiter((c["uses_efficient_equipment"] for c in consumers), dtype=bool, count=n)
+    solar = np.fromiter((c["produces_solar"] for c in consumers), dtype=bool, count=n)
+    return avg_kwh, efficient, solar
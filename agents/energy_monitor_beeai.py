@@ -1,23 +1,28 @@
+import asyncio
+
 from beeai_framework.agents.base import BaseAgent
 from beeai_framework.emitter.emitter import Emitter
 from beeai_framework.memory import UnconstrainedMemory
-from mcp.store import create_mcp
-import time
-import asyncio
+
+from agents.consumers import ConsumerTable
+from mcp.mcp_client import MCPClientError
+from observability import telemetry
+
 
 # ANSI Color Codes for colorful output
 class Colors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-    PURPLE = '\033[35m'
-    YELLOW = '\033[33m'
+    HEADER = "\033[95m"
+    OKBLUE = "\033[94m"
+    OKCYAN = "\033[96m"
+    OKGREEN = "\033[92m"
+    WARNING = "\033[93m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    BOLD = "\033[1m"
+    UNDERLINE = "\033[4m"
+    PURPLE = "\033[35m"
+    YELLOW = "\033[33m"
+
 
 def print_colored(text, color=Colors.ENDC):
     """Print text with color"""
@@ -27,8 +32,21 @@ def print_colored(text, color=Colors.ENDC):
         # Fallback for encoding issues
         print(f"{color}{text.encode('ascii', 'ignore').decode('ascii')}{Colors.ENDC}")
 
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
 class EnergyMonitorAgent(BaseAgent):
-    def __init__(self, name, mcp_client, db_path, **kwargs):
+    def __init__(
+        self,
+        name,
+        mcp_client,
+        db_path,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        shard=None,
+        journal=None,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.name = name
         self.mcp_client = mcp_client
@@ -36,11 +54,22 @@ class EnergyMonitorAgent(BaseAgent):
         self._emitter = None
         self.processed_consumers = 0
         self.total_consumers = 0
+        # consumers a resumed run had already delivered, and why streaming stopped early (if it did)
+        self.resumed = 0
+        self.error = None
+        # Credit-based flow control: one credit per consumer that has been sent but not yet
+        # acknowledged via 'consumer_processed', so the monitor never runs more than
+        # max_in_flight consumers ahead of the incentives agent.
+        self.max_in_flight = max_in_flight
+        # (shard_index, shard_count): only stream this slice of the consumers (see agents/sharded.py)
+        self.shard = shard
+        # RunJournal of a resumed run: streaming starts after its checkpoint (see agents/journal.py)
+        self.journal = journal
+        self._credits = None
 
     @property
     def memory(self):
         # Return a simple memory implementation
-        from beeai_framework.memory import UnconstrainedMemory
         return UnconstrainedMemory()
 
     def _create_emitter(self):
@@ -55,59 +84,113 @@ class EnergyMonitorAgent(BaseAgent):
         # Run the main loop directly
         await self.loop_monitor()
 
+    async def _on_consumer_processed(self, msg, event):
+        self.processed_consumers += 1
+        self._credits.release()
+
     async def loop_monitor(self, completion_event=None):
-        # Get all consumers first
-        resp = await asyncio.to_thread(self.mcp_client.request, {'cmd':'get_consumer_summary'})
-        if not resp.get('ok'):
-            print_colored(f'[Monitor] MCP error: {resp}', Colors.FAIL)
-            return
-        
-        all_consumers = resp.get('data', [])
-        self.total_consumers = len(all_consumers)
-        print_colored(f'[Monitor] *** Starting to process {self.total_consumers} consumers one by one... ***', Colors.OKCYAN + Colors.BOLD)
-        
-        # Process each consumer individually
-        for i, consumer in enumerate(all_consumers):
-            try:
-                # Send individual consumer data to incentives agent
-                msg = {
-                    'msg_id': f'{self.name}-consumer-{i}',
-                    'from': self.name,
-                    'to': 'incentives',
-                    'type': 'consumer_data',
-                    'payload': {
-                        'consumer': consumer,
-                        'consumer_index': i,
-                        'total_consumers': self.total_consumers
-                    }
-                }
-                
-                emitter = self._create_emitter()
-                await emitter.emit('consumer_data', msg)
-                print_colored(f"[Monitor] > Sent consumer {i+1}/{self.total_consumers}: {consumer['consumer_id']}", Colors.OKBLUE)
-                
-                # Wait for acknowledgment from incentives agent
-                # In a real implementation, you would listen for the acknowledgment
-                await asyncio.sleep(1)  # Simulate processing time
-                
-                self.processed_consumers += 1
-                
-            except Exception as e:
-                print_colored(f'[Monitor] *** Exception processing consumer {i}: {str(e)} ***', Colors.FAIL)
-        
-        print_colored(f"[Monitor] *** Completed processing all {self.total_consumers} consumers. Signaling completion... ***", Colors.OKGREEN + Colors.BOLD)
+        self._credits = asyncio.Semaphore(self.max_in_flight)
+        unsubscribe = self._create_emitter().on("consumer_processed", self._on_consumer_processed)
+        try:
+            await self._send_all()
+            await self._create_emitter().emit(
+                "consumers_complete",
+                {
+                    "msg_id": f"{self.name}-complete",
+                    "from": self.name,
+                    "to": "incentives",
+                    "type": "consumers_complete",
+                    "payload": {"total_consumers": self.total_consumers},
+                },
+            )
+            # taking back every credit means all outstanding acks have arrived
+            for _ in range(self.max_in_flight):
+                await self._credits.acquire()
+        finally:
+            unsubscribe()
+
+        if self.error is not None:
+            print_colored(
+                f"[Monitor] *** Streaming stopped after {self.resumed + self.processed_consumers} of {self.total_consumers} consumers. Signaling completion... ***",
+                Colors.FAIL + Colors.BOLD,
+            )
+        else:
+            print_colored(
+                f"[Monitor] *** Completed processing all {self.total_consumers} consumers. Signaling completion... ***",
+                Colors.OKGREEN + Colors.BOLD,
+            )
         if completion_event:
             completion_event.set()
 
-def run_monitor(mcp_client, db_path, shared_emitter=None, completion_event=None):
-    agent = EnergyMonitorAgent(name='monitor', mcp_client=mcp_client, db_path=db_path)
-    if shared_emitter:
-        agent._emitter = shared_emitter
-    
-    # Create a wrapper to pass completion_event to the async method
-    async def run_with_completion():
-        await agent.loop_monitor(completion_event)
-    
-    # Run the agent using the run method
-    import asyncio
-    asyncio.run(run_with_completion())
+    async def _send_all(self):
+        # Stream consumers from MCP so the first one is sent while the server is still reading
+        i = start = 0
+        with telemetry.span("monitor.stream_consumers") as span:
+            try:
+                # columnar on the wire: each chunk decodes to four lists, not one dict per consumer
+                request = {"cmd": "get_consumer_summary", "layout": "columnar"}
+                if self.shard:
+                    request.update(shard_index=self.shard[0], shard_count=self.shard[1])
+                if self.journal and self.journal.checkpoint:
+                    # consumers stream in consumer_id order, so everything up to the checkpoint is done
+                    request["after_consumer_id"] = self.journal.checkpoint
+                    i = start = self.resumed = self.journal.done
+                async for chunk in self.mcp_client.astream(request):
+                    if i == start:
+                        self.total_consumers = chunk.get("total", 0)
+                        if start:
+                            print_colored(
+                                f"[Monitor] *** Resuming run {self.journal.run_id} after {self.journal.checkpoint} ({start} of {self.total_consumers} already done)... ***",
+                                Colors.OKCYAN + Colors.BOLD,
+                            )
+                        else:
+                            print_colored(
+                                f"[Monitor] *** Starting to process {self.total_consumers} consumers one by one... ***",
+                                Colors.OKCYAN + Colors.BOLD,
+                            )
+                    for consumer in ConsumerTable.from_payload(chunk["data"]):
+                        await self.send_consumer(i, consumer)
+                        i += 1
+                if i == start:
+                    # no chunk carried a total: nothing was left after the checkpoint
+                    self.total_consumers = start
+            except MCPClientError as e:
+                # still signal completion so incentives drains, but the run is not complete
+                self.error = e
+                print_colored(f"[Monitor] MCP error: {e}", Colors.FAIL)
+            span.set_attribute("consumers", i - start)
+
+    async def send_consumer(self, i, consumer):
+        # blocks while max_in_flight consumers are still unacknowledged
+        await self._credits.acquire()
+        try:
+            # Send individual consumer data to incentives agent
+            msg = {
+                "msg_id": f"{self.name}-consumer-{i}",
+                "from": self.name,
+                "to": "incentives",
+                "type": "consumer_data",
+                "payload": {
+                    "consumer": consumer,
+                    "consumer_index": i,
+                    "total_consumers": self.total_consumers,
+                },
+            }
+
+            emitter = self._create_emitter()
+            # includes the time incentives keeps us waiting on a full inbox
+            with telemetry.timed(
+                "monitor.emit", "agents.emit.duration", {"event": "consumer_data"}
+            ):
+                await emitter.emit("consumer_data", msg)
+            print_colored(
+                f"[Monitor] > Sent consumer {i+1}/{self.total_consumers}: {consumer['consumer_id']}",
+                Colors.OKBLUE,
+            )
+
+        except Exception as e:
+            # nothing will acknowledge this consumer, so hand its credit back
+            self._credits.release()
+            print_colored(
+                f"[Monitor] *** Exception processing consumer {i}: {str(e)} ***", Colors.FAIL
+            )
@@ -1,23 +1,45 @@
+import asyncio
+import os
+
 from beeai_framework.agents.base import BaseAgent
 from beeai_framework.emitter.emitter import Emitter
 from beeai_framework.memory import UnconstrainedMemory
-from llm.watson_client import generate_prompt, prompt_templates
-import time
-import asyncio
+
+from agents import discounts
+from llm.templates import render_letter
+from llm.watson_client import (
+    LLM_BATCH_SIZE,
+    LLM_CONCURRENCY,
+    agenerate_batch,
+    agenerate_prompt,
+    generate_prompt,
+)
+from observability import telemetry
+
+# How letters are produced:
+#   template - precompiled scenario template only, no LLM calls
+#   hybrid   - template plus a short LLM-written personal paragraph (default)
+#   llm      - the whole letter is written by the LLM, template as fallback
+NOTIFICATION_MODES = ("template", "hybrid", "llm")
+NOTIFICATION_MODE = os.getenv("NOTIFICATION_MODE", "hybrid").lower()
+PERSONAL_NOTE_MAX_CHARS = 600
+PERSONAL_NOTE_MAX_TOKENS = 150
+
 
 # ANSI Color Codes for colorful output
 class Colors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-    PURPLE = '\033[35m'
-    YELLOW = '\033[33m'
+    HEADER = "\033[95m"
+    OKBLUE = "\033[94m"
+    OKCYAN = "\033[96m"
+    OKGREEN = "\033[92m"
+    WARNING = "\033[93m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    BOLD = "\033[1m"
+    UNDERLINE = "\033[4m"
+    PURPLE = "\033[35m"
+    YELLOW = "\033[33m"
+
 
 def print_colored(text, color=Colors.ENDC):
     """Print text with color"""
@@ -27,17 +49,169 @@ def print_colored(text, color=Colors.ENDC):
         # Fallback for encoding issues
         print(f"{color}{text.encode('ascii', 'ignore').decode('ascii')}{Colors.ENDC}")
 
+
+# Prompt pieces per scenario: facts are appended to each consumer's details, instructions
+# are shared by every consumer in the scenario (and sent once per batched LLM call)
+NOTIFICATION_PROMPTS = {
+    "10_percent": {
+        "note": "Encourage them to keep up their habits and share what works with neighbours.",
+        "facts": ["Usage is below 4 kWh threshold: Yes", "Eligible for 10% discount: Yes"],
+        "instructions": '''Write a complete congratulatory letter that includes:
+1. Greeting with consumer ID
+2. Mention their specific average daily usage and that it's below 4 kWh threshold
+3. Explain they qualify for 10% discount due to low usage + efficient equipment + solar
+4. Thank them for helping reduce carbon emissions
+5. Sign off as "Your Community Energy Team"''',
+    },
+    "5_percent_efficient": {
+        "note": "Explain how solar panels could fit their usage and unlock the extra 5%.",
+        "facts": [
+            "Usage is below 4 kWh threshold: Yes",
+            "Eligible for 5% discount: Yes (efficient equipment)",
+        ],
+        "instructions": '''Write a complete letter that includes:
+1. Greeting with consumer ID
+2. Mention their specific average daily usage and that it's below 4 kWh threshold
+3. Explain they qualify for 5% discount due to low usage + efficient equipment
+4. Suggest installing solar panels for additional 5% discount
+5. Sign off as "Your Community Energy Team"''',
+    },
+    "5_percent_solar": {
+        "note": "Suggest one efficient-equipment upgrade that suits their usage and unlocks the extra 5%.",
+        "facts": [
+            "Usage is below 4 kWh threshold: Yes",
+            "Eligible for 5% discount: Yes (solar production)",
+        ],
+        "instructions": '''Write a complete letter that includes:
+1. Greeting with consumer ID
+2. Mention their specific average daily usage and that it's below 4 kWh threshold
+3. Explain they qualify for 5% discount due to low usage + solar production
+4. Suggest upgrading to energy efficient equipment for additional 5% discount
+5. Sign off as "Your Community Energy Team"''',
+    },
+    "no_discount_low_usage": {
+        "note": "Suggest the easiest first step towards a discount given their usage.",
+        "facts": [
+            "Usage is below 4 kWh threshold: Yes",
+            "Eligible for discount: No (missing efficient equipment and solar)",
+        ],
+        "instructions": '''Write a complete letter that includes:
+1. Greeting with consumer ID
+2. Congratulate them on their low average daily usage and being below 4 kWh threshold
+3. Explain they're not eligible for discounts yet
+4. List what they need to do to qualify:
+   - Install energy efficient equipment (5% discount)
+   - Add solar panels (5% discount)
+   - Or both for 10% discount
+5. Sign off as "Your Community Energy Team"''',
+    },
+    "high_usage": {
+        "note": "Suggest two concrete ways to bring their daily usage under 4 kWh.",
+        "facts": ["Usage is above 4 kWh threshold: Yes", "Eligible for discount: No (high usage)"],
+        "instructions": '''Write a complete letter that includes:
+1. Greeting with consumer ID
+2. Mention their current average daily usage
+3. Explain they need to reduce usage to below 4 kWh/day to qualify
+4. List all steps to qualify for discounts:
+   - Reduce usage to below 4 kWh/day
+   - Install energy efficient equipment (5% discount)
+   - Add solar panels (5% discount)
+   - Or all three for 10% discount
+5. Sign off as "Your Community Energy Team"''',
+    },
+    None: {
+        "note": "Give one practical energy saving tip suited to their usage.",
+        "facts": [],
+        "instructions": '''Write a complete helpful letter with personalized energy efficiency recommendations.
+Sign off as "Your Community Energy Team"''',
+    },
+}
+
+# Hybrid mode: the LLM writes only this paragraph, the rest of the letter comes from the template
+PERSONAL_NOTE_INSTRUCTIONS = """Write one short personalized paragraph (2-3 sentences) for this consumer's energy letter.
+{note}
+Do not include a greeting, a sign-off or the discount terms; they are already in the letter."""
+
+
+class NotificationBatcher:
+    """Groups incoming consumers by scenario and generates each group's letters with one
+    batched LLM call. A group is sent when it reaches batch_size or max_wait seconds after
+    its first consumer arrived, whichever comes first."""
+
+    def __init__(self, agent, batch_size, max_wait=0.05):
+        self.agent = agent
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._groups = {}
+        self._timers = {}
+        self._tasks = set()
+
+    def submit(self, consumer):
+        """Returns a future resolved with (scenario, message) for this consumer"""
+        loop = asyncio.get_running_loop()
+        scenario = self.agent.determine_discount_scenario(consumer)
+        fut = loop.create_future()
+        group = self._groups.setdefault(scenario, [])
+        group.append((consumer, fut))
+        if len(group) >= self.batch_size:
+            self.flush(scenario)
+        elif len(group) == 1:
+            self._timers[scenario] = loop.call_later(self.max_wait, self.flush, scenario)
+        return fut
+
+    def flush(self, scenario):
+        timer = self._timers.pop(scenario, None)
+        if timer:
+            timer.cancel()
+        group = self._groups.pop(scenario, None)
+        if group:
+            task = asyncio.create_task(self.agent.generate_batch(scenario, group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def flush_all(self):
+        for scenario in list(self._groups):
+            self.flush(scenario)
+
+
 class IncentivesAgent(BaseAgent):
-    def __init__(self, name, mcp_client, **kwargs):
+    def __init__(
+        self,
+        name,
+        mcp_client,
+        usage_threshold=discounts.USAGE_THRESHOLD_KWH,
+        inbox_size=8,
+        llm_concurrency=LLM_CONCURRENCY,
+        batch_size=LLM_BATCH_SIZE,
+        notification_mode=NOTIFICATION_MODE,
+        journal=None,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.name = name
         self.mcp_client = mcp_client
+        self.usage_threshold = usage_threshold
+        self.inbox_size = inbox_size
+        # notifications generated concurrently; delivery (print + ack) stays in arrival order
+        self.llm_concurrency = max(1, llm_concurrency)
+        # >1 packs that many same-scenario consumers into one LLM call
+        self.batch_size = max(1, batch_size)
+        if notification_mode not in NOTIFICATION_MODES:
+            raise ValueError(
+                f"notification_mode must be one of {NOTIFICATION_MODES}, got {notification_mode!r}"
+            )
+        self.notification_mode = notification_mode
+        # RunJournal: delivered notifications are recorded so an interrupted run can resume
+        self.journal = journal
+        self._inbox = None
         self._emitter = None
+        self.scenarios = {}
+        # deliveries that raised; a journaled run with failures stays open for a retry
+        self.failed = 0
 
     @property
     def memory(self):
         # Return a simple memory implementation
-        from beeai_framework.memory import UnconstrainedMemory
         return UnconstrainedMemory()
 
     def _create_emitter(self):
@@ -54,379 +228,342 @@ class IncentivesAgent(BaseAgent):
 
     def determine_discount_scenario(self, consumer_data):
         """Determine the discount scenario based on consumer data"""
-        avg_kwh = consumer_data['avg_kwh']
-        uses_efficient = consumer_data['uses_efficient_equipment']
-        produces_solar = consumer_data['produces_solar']
-        
-        if avg_kwh < 4.0:
-            if uses_efficient and produces_solar:
-                return '10_percent'
-            elif uses_efficient:
-                return '5_percent_efficient'
-            elif produces_solar:
-                return '5_percent_solar'
-            else:
-                return 'no_discount_low_usage'
-        else:
-            return 'high_usage'
+        with telemetry.span("incentives.classify") as span:
+            scenario = discounts.classify(
+                consumer_data["avg_kwh"],
+                consumer_data["uses_efficient_equipment"],
+                consumer_data["produces_solar"],
+                self.usage_threshold,
+            )
+            span.set_attribute("scenario", scenario)
+            return scenario
 
     def get_scenario_color(self, scenario):
         """Get color for different discount scenarios"""
         colors = {
-            '10_percent': Colors.OKGREEN + Colors.BOLD,  # Bright green for highest discount
-            '5_percent_efficient': Colors.OKCYAN + Colors.BOLD,  # Cyan for efficient equipment
-            '5_percent_solar': Colors.PURPLE + Colors.BOLD,  # Purple for solar
-            'no_discount_low_usage': Colors.YELLOW + Colors.BOLD,  # Yellow for no discount
-            'high_usage': Colors.WARNING + Colors.BOLD  # Orange for high usage
+            "10_percent": Colors.OKGREEN + Colors.BOLD,  # Bright green for highest discount
+            "5_percent_efficient": Colors.OKCYAN + Colors.BOLD,  # Cyan for efficient equipment
+            "5_percent_solar": Colors.PURPLE + Colors.BOLD,  # Purple for solar
+            "no_discount_low_usage": Colors.YELLOW + Colors.BOLD,  # Yellow for no discount
+            "high_usage": Colors.WARNING + Colors.BOLD,  # Orange for high usage
         }
         return colors.get(scenario, Colors.ENDC)
 
     def get_scenario_icon(self, scenario):
         """Get icon for different discount scenarios"""
         icons = {
-            '10_percent': '[TOP]',
-            '5_percent_efficient': '[EFF]',
-            '5_percent_solar': '[SOL]',
-            'no_discount_low_usage': '[INFO]',
-            'high_usage': '[HIGH]'
+            "10_percent": "[TOP]",
+            "5_percent_efficient": "[EFF]",
+            "5_percent_solar": "[SOL]",
+            "no_discount_low_usage": "[INFO]",
+            "high_usage": "[HIGH]",
         }
-        return icons.get(scenario, '[GEN]')
+        return icons.get(scenario, "[GEN]")
 
     def generate_notification_message(self, consumer, scenario):
         """Generate a personalized notification message using LLM"""
-        consumer_id = consumer['consumer_id']
-        avg_kwh = consumer['avg_kwh']
-        uses_efficient = consumer['uses_efficient_equipment']
-        produces_solar = consumer['produces_solar']
-        
-        # Create a detailed prompt for the LLM
-        if scenario == '10_percent':
-            prompt = f"""Write a complete energy efficiency notification letter for consumer {consumer_id}.
-
-Consumer Details:
-- Average daily usage: {avg_kwh} kWh/day
-- Uses energy efficient equipment: {uses_efficient}
-- Produces solar energy: {produces_solar}
-- Usage is below 4 kWh threshold: Yes
-- Eligible for 10% discount: Yes
-
-Write a complete congratulatory letter that includes:
-1. Greeting with consumer ID
-2. Mention their specific usage ({avg_kwh} kWh/day) and that it's below 4 kWh threshold
-3. Explain they qualify for 10% discount due to low usage + efficient equipment + solar
-4. Thank them for helping reduce carbon emissions
-5. Sign off as "Your Community Energy Team"
-
-Write the complete letter:"""
-        
-        elif scenario == '5_percent_efficient':
-            prompt = f"""Write a complete energy efficiency notification letter for consumer {consumer_id}.
-
-Consumer Details:
-- Average daily usage: {avg_kwh} kWh/day
-- Uses energy efficient equipment: {uses_efficient}
-- Produces solar energy: {produces_solar}
-- Usage is below 4 kWh threshold: Yes
-- Eligible for 5% discount: Yes (efficient equipment)
-
-Write a complete letter that includes:
-1. Greeting with consumer ID
-2. Mention their specific usage ({avg_kwh} kWh/day) and that it's below 4 kWh threshold
-3. Explain they qualify for 5% discount due to low usage + efficient equipment
-4. Suggest installing solar panels for additional 5% discount
-5. Sign off as "Your Community Energy Team"
-
-Write the complete letter:"""
-        
-        elif scenario == '5_percent_solar':
-            prompt = f"""Write a complete energy efficiency notification letter for consumer {consumer_id}.
-
-Consumer Details:
-- Average daily usage: {avg_kwh} kWh/day
-- Uses energy efficient equipment: {uses_efficient}
-- Produces solar energy: {produces_solar}
-- Usage is below 4 kWh threshold: Yes
-- Eligible for 5% discount: Yes (solar production)
-
-Write a complete letter that includes:
-1. Greeting with consumer ID
-2. Mention their specific usage ({avg_kwh} kWh/day) and that it's below 4 kWh threshold
-3. Explain they qualify for 5% discount due to low usage + solar production
-4. Suggest upgrading to energy efficient equipment for additional 5% discount
-5. Sign off as "Your Community Energy Team"
-
-Write the complete letter:"""
-        
-        elif scenario == 'no_discount_low_usage':
-            prompt = f"""Write a complete energy efficiency notification letter for consumer {consumer_id}.
-
-Consumer Details:
-- Average daily usage: {avg_kwh} kWh/day
-- Uses energy efficient equipment: {uses_efficient}
-- Produces solar energy: {produces_solar}
-- Usage is below 4 kWh threshold: Yes
-- Eligible for discount: No (missing efficient equipment and solar)
-
-Write a complete letter that includes:
-1. Greeting with consumer ID
-2. Congratulate them on low usage ({avg_kwh} kWh/day) and being below 4 kWh threshold
-3. Explain they're not eligible for discounts yet
-4. List what they need to do to qualify:
-   - Install energy efficient equipment (5% discount)
-   - Add solar panels (5% discount)
-   - Or both for 10% discount
-5. Sign off as "Your Community Energy Team"
-
-Write the complete letter:"""
-        
-        elif scenario == 'high_usage':
-            prompt = f"""Write a complete energy efficiency notification letter for consumer {consumer_id}.
-
-Consumer Details:
-- Average daily usage: {avg_kwh} kWh/day
-- Uses energy efficient equipment: {uses_efficient}
-- Produces solar energy: {produces_solar}
-- Usage is above 4 kWh threshold: Yes
-- Eligible for discount: No (high usage)
-
-Write a complete letter that includes:
-1. Greeting with consumer ID
-2. Mention their current usage ({avg_kwh} kWh/day)
-3. Explain they need to reduce usage to below 4 kWh/day to qualify
-4. List all steps to qualify for discounts:
-   - Reduce usage to below 4 kWh/day
-   - Install energy efficient equipment (5% discount)
-   - Add solar panels (5% discount)
-   - Or all three for 10% discount
-5. Sign off as "Your Community Energy Team"
-
-Write the complete letter:"""
-        
-        else:
-            prompt = f"""Write a complete energy efficiency notification letter for consumer {consumer_id}.
-
-Consumer Details:
-- Average daily usage: {avg_kwh} kWh/day
-- Uses energy efficient equipment: {uses_efficient}
-- Produces solar energy: {produces_solar}
-
-Write a complete helpful letter with personalized energy efficiency recommendations.
-Sign off as "Your Community Energy Team"
-
-Write the complete letter:"""
-        
-        # Use LLM to generate the message
-        try:
-            resp_text = generate_prompt(prompt)
-            if isinstance(resp_text, dict) and 'results' in resp_text:
-                text = resp_text['results'][0].get('generated_text', '')
-                # Clean up the response
-                if '[MOCK LLM]' in text:
-                    # Remove the mock prefix and use the rest
-                    text = text.replace('[MOCK LLM]\n', '').replace('[MOCK LLM]', '')
-                
-                # If the response is too short or incomplete, use fallback
-                if len(text.strip()) < 100 or 'Dear' not in text:
-                    return self._get_fallback_message(consumer, scenario)
-                
-                return text.strip()
-            else:
+        if self.notification_mode == "template":
+            return render_letter(scenario, consumer)
+        prompt = self.build_notification_prompt(consumer, scenario)
+        with telemetry.timed(
+            "incentives.generate_notification",
+            "incentives.notification.duration",
+            self._span_attrs(scenario),
+        ):
+            try:
+                return self._message_from_response(
+                    generate_prompt(prompt, self._llm_params()), consumer, scenario
+                )
+            except Exception as e:
+                print_colored(f"[Incentives] LLM generation failed: {e}", Colors.FAIL)
                 return self._get_fallback_message(consumer, scenario)
-        except Exception as e:
-            print_colored(f"[Incentives] LLM generation failed: {e}", Colors.FAIL)
-            return self._get_fallback_message(consumer, scenario)
-
-    def _get_fallback_message(self, consumer, scenario):
-        """Fallback to template messages if LLM fails"""
-        consumer_id = consumer['consumer_id']
-        avg_kwh = consumer['avg_kwh']
-        
-        if scenario == '10_percent':
-            return f"""Dear {consumer_id},
-
-Congratulations! Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold.
-
-You are using Energy Efficient equipment and have produced solar energy. You are eligible for a 10% discount on your next bill!
-
-This is the highest discount tier available, recognizing your outstanding commitment to energy efficiency and renewable energy production. Your efforts are helping our community reduce carbon emissions and move toward a more sustainable future.
-
-Thank you for being a leader in energy conservation!
-
--- Your Community Energy Team"""
-        
-        elif scenario == '5_percent_efficient':
-            return f"""Dear {consumer_id},
 
-Great news! Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold.
-
-You are using Energy Efficient equipment. You are eligible for a 5% discount on your next bill!
-
-To qualify for an additional 5% discount (total 10%), consider installing solar panels. This would not only increase your savings but also contribute to our community's renewable energy goals.
-
-Keep up the great work with energy efficiency!
-
--- Your Community Energy Team"""
-        
-        elif scenario == '5_percent_solar':
-            return f"""Dear {consumer_id},
-
-Excellent! Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold.
-
-You have produced solar energy. You are eligible for a 5% discount on your next bill!
-
-To qualify for an additional 5% discount (total 10%), consider upgrading to Energy Efficient equipment. This combination of solar production and efficient appliances would maximize your savings and environmental impact.
-
-Your solar contribution is making a difference!
-
--- Your Community Energy Team"""
-        
-        elif scenario == 'no_discount_low_usage':
-            return f"""Dear {consumer_id},
-
-Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold - great job on keeping your consumption low!
+    async def agenerate_notification_message(self, consumer, scenario):
+        """Async variant: the LLM call runs on the bounded LLM worker pool, off the event loop"""
+        if self.notification_mode == "template":
+            return render_letter(scenario, consumer)
+        prompt = self.build_notification_prompt(consumer, scenario)
+        with telemetry.timed(
+            "incentives.generate_notification",
+            "incentives.notification.duration",
+            self._span_attrs(scenario),
+        ):
+            try:
+                return self._message_from_response(
+                    await agenerate_prompt(prompt, self._llm_params()), consumer, scenario
+                )
+            except Exception as e:
+                print_colored(f"[Incentives] LLM generation failed: {e}", Colors.FAIL)
+                return self._get_fallback_message(consumer, scenario)
 
-However, you are not currently eligible for discounts. To qualify for discounts:
+    def _span_attrs(self, scenario):
+        return {"scenario": str(scenario), "notification_mode": self.notification_mode}
 
-• Install Energy Efficient equipment (5% discount)
-• Add solar panels (5% discount)
-• Or both for a 10% discount!
+    def _llm_params(self):
+        # a personal paragraph needs far fewer tokens than a whole letter
+        return (
+            {"max_new_tokens": PERSONAL_NOTE_MAX_TOKENS}
+            if self.notification_mode == "hybrid"
+            else None
+        )
 
-You're already on the right track with low usage. These additional steps would help you save money while contributing to our community's sustainability goals.
+    def _batch_params(self):
+        # hybrid batches ask for paragraphs, each with a paragraph-sized budget
+        if self.notification_mode == "hybrid":
+            return {"unit": "paragraph", "tokens_per_item": PERSONAL_NOTE_MAX_TOKENS}
+        return {}
 
-We're here to help you make these improvements!
+    def build_notification_prompt(self, consumer, scenario):
+        """Build the LLM prompt for a consumer's notification letter (or personal paragraph)"""
+        if self.notification_mode == "hybrid":
+            return f"""{self.consumer_details(consumer, scenario)}
 
--- Your Community Energy Team"""
-        
-        elif scenario == 'high_usage':
-            return f"""Dear {consumer_id},
+{self.notification_instructions(scenario)}
 
-Your average energy usage over the past month was {avg_kwh} kWh/day.
+Write the paragraph:"""
+        return f"""Write a complete energy efficiency notification letter for consumer {consumer['consumer_id']}.
 
-To qualify for discounts and reduce your energy costs:
+{self.consumer_details(consumer, scenario)}
 
-• Reduce usage to below 4 kWh/day
-• Install Energy Efficient equipment (5% discount)
-• Add solar panels (5% discount)
-• Or all three for 10% discount!
+{self.notification_instructions(scenario)}
 
-We understand that reducing energy usage can be challenging. Our team can provide personalized recommendations to help you achieve these goals. Small changes like using energy-efficient appliances, adjusting thermostat settings, and shifting high-usage activities to off-peak hours can make a significant difference.
+Write the complete letter:"""
 
-Let's work together to reduce your energy costs and environmental impact!
+    def consumer_details(self, consumer, scenario):
+        """Per-consumer facts for the prompt (the only part that differs within a scenario)"""
+        facts = NOTIFICATION_PROMPTS.get(scenario, NOTIFICATION_PROMPTS[None])["facts"]
+        lines = [
+            "Consumer Details:",
+            f"- Consumer ID: {consumer['consumer_id']}",
+            f"- Average daily usage: {consumer['avg_kwh']} kWh/day",
+            f"- Uses energy efficient equipment: {consumer['uses_efficient_equipment']}",
+            f"- Produces solar energy: {consumer['produces_solar']}",
+        ]
+        return "\n".join(lines + [f"- {fact}" for fact in facts])
+
+    def notification_instructions(self, scenario):
+        """Letter instructions shared by every consumer in a scenario"""
+        prompts = NOTIFICATION_PROMPTS.get(scenario, NOTIFICATION_PROMPTS[None])
+        if self.notification_mode == "hybrid":
+            return PERSONAL_NOTE_INSTRUCTIONS.format(note=prompts["note"])
+        return prompts["instructions"]
+
+    def _message_from_response(self, resp_text, consumer, scenario):
+        """Extract the letter from an LLM response, falling back to the template"""
+        if self.notification_mode == "hybrid":
+            return render_letter(scenario, consumer, self._personal_note(resp_text))
+        if isinstance(resp_text, dict) and "results" in resp_text:
+            text = resp_text["results"][0].get("generated_text", "")
+            # Clean up the response
+            if "[MOCK LLM]" in text:
+                # Remove the mock prefix and use the rest
+                text = text.replace("[MOCK LLM]\n", "").replace("[MOCK LLM]", "")
+
+            # If the response is too short or incomplete, use fallback
+            if len(text.strip()) < 100 or "Dear" not in text:
+                return self._get_fallback_message(consumer, scenario)
 
--- Your Community Energy Team"""
-        
+            return text.strip()
         else:
-            return f"""Dear {consumer_id},
-
-Your average energy usage over the past month was {avg_kwh} kWh/day.
+            return self._get_fallback_message(consumer, scenario)
 
-We're here to help you optimize your energy consumption and potentially qualify for discounts. Our team can provide personalized energy efficiency recommendations based on your specific situation.
+    def _personal_note(self, resp):
+        """The LLM's personal paragraph, or None when the response is unusable"""
+        if not (isinstance(resp, dict) and resp.get("results")):
+            return None
+        text = resp["results"][0].get("generated_text", "").strip()
+        # the mock client only echoes the prompt, which is no note at all
+        if not text or text.startswith("[MOCK LLM"):
+            return None
+        if len(text) > PERSONAL_NOTE_MAX_CHARS:
+            text = text[:PERSONAL_NOTE_MAX_CHARS].rsplit(". ", 1)[0].rstrip(".") + "."
+        return text
 
-Please contact us for a detailed energy audit and customized recommendations to help you save money and reduce your environmental impact.
+    def _get_fallback_message(self, consumer, scenario):
+        """Fallback to template messages if LLM fails"""
+        telemetry.counter("incentives.notification.fallbacks").add(1, {"scenario": str(scenario)})
+        return render_letter(scenario, consumer)
 
--- Your Community Energy Team"""
+    async def _enqueue(self, msg, event):
+        # Blocks the monitor's emit while the inbox is full, which is what throttles it
+        await self._inbox.put(msg)
 
     async def loop_incentives(self, completion_event=None):
+        """Consume the monitor's 'consumer_data' stream until it emits 'consumers_complete'"""
+        self._inbox = asyncio.Queue(maxsize=self.inbox_size)
+        emitter = self._create_emitter()
+        unsubscribers = [
+            emitter.on("consumer_data", self._enqueue),
+            emitter.on("consumers_complete", self._enqueue),
+        ]
         processed_consumers = 0
         total_consumers = 0
-        
-        while True:
-            try:
-                # Listen for individual consumer data from monitor agent
-                emitter = self._create_emitter()
-                
-                # Simulate receiving consumer data (in real implementation, you'd listen for events)
-                if processed_consumers == 0:
-                    # Get all consumers to know the total count
-                    resp = await asyncio.to_thread(self.mcp_client.request, {'cmd':'get_consumer_summary'})
-                    if not resp.get('ok'):
-                        print_colored(f'[Incentives] MCP error: {resp}', Colors.FAIL)
-                        continue
-                    
-                    all_consumers = resp.get('data', [])
-                    total_consumers = len(all_consumers)
-                    print_colored(f'[Incentives] *** Ready to process {total_consumers} consumers one by one... ***', Colors.OKCYAN + Colors.BOLD)
-                
-                # Process one consumer at a time
-                if processed_consumers < total_consumers:
-                    consumer = all_consumers[processed_consumers]
-                    
-                    # Determine scenario for this consumer
+        scenarios = {name: 0 for name in discounts.SCENARIOS}
+        print_colored(
+            "[Incentives] *** Ready to process consumers as the monitor sends them... ***",
+            Colors.OKCYAN + Colors.BOLD,
+        )
+
+        # Notification tasks in arrival order; the bound caps how many run ahead of delivery
+        ordered = asyncio.Queue(maxsize=self.llm_concurrency * self.batch_size)
+        use_llm = self.notification_mode != "template"
+        batcher = (
+            NotificationBatcher(self, self.batch_size) if use_llm and self.batch_size > 1 else None
+        )
+        loop = asyncio.get_running_loop()
+
+        async def generate():
+            while True:
+                msg = await self._inbox.get()
+                if msg["type"] == "consumers_complete":
+                    if batcher:
+                        batcher.flush_all()
+                    await ordered.put((msg["payload"], None))
+                    return
+                consumer = msg["payload"]["consumer"]
+                if self.journal and self.journal.is_done(consumer["consumer_id"]):
+                    # already notified earlier in this run: only acknowledge it
+                    task = loop.create_future()
+                    task.set_result((None, None))
+                elif not use_llm:
+                    # template rendering is cheap enough to do inline
+                    task = loop.create_future()
                     scenario = self.determine_discount_scenario(consumer)
-                    scenario_color = self.get_scenario_color(scenario)
-                    scenario_icon = self.get_scenario_icon(scenario)
-                    
-                    # Generate and display notification
-                    print_colored(f'\n[Incentives] {scenario_icon} Processing consumer {processed_consumers + 1}/{total_consumers}: {consumer["consumer_id"]} ({scenario})', scenario_color)
-                    message = self.generate_notification_message(consumer, scenario)
-                    
-                    # Print notification with scenario-specific color
-                    print_colored(f"NOTIFICATION for {consumer['consumer_id']}:", scenario_color)
-                    print_colored(message, Colors.ENDC)
-                    print_colored("-" * 80, Colors.OKBLUE)
-                    
-                    # Send acknowledgment back to monitor
-                    ack_msg = {
-                        'msg_id': f'incentives-ack-{processed_consumers}',
-                        'from': 'incentives',
-                        'to': 'monitor',
-                        'type': 'consumer_processed',
-                        'payload': {
-                            'consumer_id': consumer['consumer_id'],
-                            'scenario': scenario,
-                            'processed_index': processed_consumers
-                        }
-                    }
-                    await emitter.emit('consumer_processed', ack_msg)
-                    print_colored(f"[Incentives] > Acknowledged processing of {consumer['consumer_id']}", Colors.OKGREEN)
-                    
-                    processed_consumers += 1
-                    
-                    # Small delay to simulate processing time
-                    await asyncio.sleep(0.5)
-                    
+                    task.set_result((scenario, render_letter(scenario, consumer)))
+                elif batcher:
+                    task = batcher.submit(consumer)
                 else:
-                    # All consumers processed
-                    print_colored(f'\n[Incentives] *** Completed processing all {total_consumers} consumers. ***', Colors.OKGREEN + Colors.BOLD)
-                    print_colored(f'[Incentives] *** Summary of processed consumers: ***', Colors.HEADER + Colors.BOLD)
-                    
-                    # Generate summary
-                    scenarios = {
-                        '10_percent': 0,
-                        '5_percent_efficient': 0,
-                        '5_percent_solar': 0,
-                        'no_discount_low_usage': 0,
-                        'high_usage': 0
-                    }
-                    
-                    for consumer in all_consumers:
-                        scenario = self.determine_discount_scenario(consumer)
-                        scenarios[scenario] += 1
-                    
-                    # Print summary with colors
-                    print_colored(f'  [TOP] 10% discount eligible: {scenarios["10_percent"]}', Colors.OKGREEN + Colors.BOLD)
-                    print_colored(f'  [EFF] 5% discount (efficient): {scenarios["5_percent_efficient"]}', Colors.OKCYAN + Colors.BOLD)
-                    print_colored(f'  [SOL] 5% discount (solar): {scenarios["5_percent_solar"]}', Colors.PURPLE + Colors.BOLD)
-                    print_colored(f'  [INFO] No discount (low usage): {scenarios["no_discount_low_usage"]}', Colors.YELLOW + Colors.BOLD)
-                    print_colored(f'  [HIGH] High usage: {scenarios["high_usage"]}', Colors.WARNING + Colors.BOLD)
-                    
-                    if completion_event:
-                        completion_event.set()
-                    break
-                        
-            except Exception as e:
-                print_colored(f'[Incentives] *** Exception: {str(e)} ***', Colors.FAIL)
-                await asyncio.sleep(1)
-
-def run_incentives(mcp_client, shared_emitter=None, completion_event=None):
-    agent = IncentivesAgent(name='incentives', mcp_client=mcp_client)
-    if shared_emitter:
-        agent._emitter = shared_emitter
-    
-    # Create a wrapper to pass completion_event to the async method
-    async def run_with_completion():
-        await agent.loop_incentives(completion_event)
-    
-    # Run the agent using the run method
-    import asyncio
-    asyncio.run(run_with_completion())
+                    task = asyncio.create_task(self.prepare_notification(consumer))
+                await ordered.put((msg["payload"], task))
+
+        async def deliver():
+            nonlocal processed_consumers, total_consumers
+            while True:
+                payload, task = await ordered.get()
+                total_consumers = payload["total_consumers"]
+                if task is None:
+                    return
+                scenario = await self.deliver_notification(
+                    payload["consumer"], payload["consumer_index"], total_consumers, task
+                )
+                if scenario:
+                    scenarios[scenario] += 1
+                processed_consumers += 1
+
+        try:
+            await asyncio.gather(generate(), deliver())
+        finally:
+            for unsubscribe in unsubscribers:
+                unsubscribe()
+            if self.journal:
+                self.journal.flush()
+
+        # All consumers processed
+        print_colored(
+            f"\n[Incentives] *** Completed processing all {total_consumers} consumers. ***",
+            Colors.OKGREEN + Colors.BOLD,
+        )
+        print_colored(
+            "[Incentives] *** Summary of processed consumers: ***", Colors.HEADER + Colors.BOLD
+        )
+
+        # Print summary with colors
+        print_colored(
+            f'  [TOP] 10% discount eligible: {scenarios["10_percent"]}',
+            Colors.OKGREEN + Colors.BOLD,
+        )
+        print_colored(
+            f'  [EFF] 5% discount (efficient): {scenarios["5_percent_efficient"]}',
+            Colors.OKCYAN + Colors.BOLD,
+        )
+        print_colored(
+            f'  [SOL] 5% discount (solar): {scenarios["5_percent_solar"]}',
+            Colors.PURPLE + Colors.BOLD,
+        )
+        print_colored(
+            f'  [INFO] No discount (low usage): {scenarios["no_discount_low_usage"]}',
+            Colors.YELLOW + Colors.BOLD,
+        )
+        print_colored(
+            f'  [HIGH] High usage: {scenarios["high_usage"]}', Colors.WARNING + Colors.BOLD
+        )
+
+        self.scenarios = scenarios
+        if completion_event:
+            completion_event.set()
+        return scenarios
+
+    async def prepare_notification(self, consumer):
+        """Classify one consumer and generate its notification; runs concurrently with others"""
+        scenario = self.determine_discount_scenario(consumer)
+        message = await self.agenerate_notification_message(consumer, scenario)
+        return scenario, message
+
+    async def generate_batch(self, scenario, group):
+        """Generate letters for same-scenario (consumer, future) pairs with one LLM call"""
+        items = [(c["consumer_id"], self.consumer_details(c, scenario)) for c, _ in group]
+        try:
+            with telemetry.timed(
+                "incentives.generate_batch",
+                "incentives.batch.duration",
+                dict(self._span_attrs(scenario), items=len(items)),
+            ):
+                responses = await agenerate_batch(
+                    self.notification_instructions(scenario), items, **self._batch_params()
+                )
+        except Exception as e:
+            print_colored(f"[Incentives] Batched LLM generation failed: {e}", Colors.FAIL)
+            responses = [None] * len(group)
+        for (consumer, fut), resp in zip(group, responses):
+            if not fut.done():
+                fut.set_result((scenario, self._message_from_response(resp, consumer, scenario)))
+
+    async def deliver_notification(self, consumer, index, total_consumers, task):
+        """Print a prepared notification and acknowledge the consumer to the monitor"""
+        scenario = None
+        try:
+            scenario, message = await task
+            if message is None:
+                return None
+            scenario_color = self.get_scenario_color(scenario)
+            scenario_icon = self.get_scenario_icon(scenario)
+
+            # Display notification
+            print_colored(
+                f'\n[Incentives] {scenario_icon} Processing consumer {index + 1}/{total_consumers}: {consumer["consumer_id"]} ({scenario})',
+                scenario_color,
+            )
+
+            # Print notification with scenario-specific color
+            print_colored(f"NOTIFICATION for {consumer['consumer_id']}:", scenario_color)
+            print_colored(message, Colors.ENDC)
+            print_colored("-" * 80, Colors.OKBLUE)
+            if self.journal:
+                self.journal.record(consumer["consumer_id"], scenario, message)
+        except Exception as e:
+            print_colored(f"[Incentives] *** Exception: {str(e)} ***", Colors.FAIL)
+            self.failed += 1
+            if self.journal:
+                self.journal.record(consumer["consumer_id"], scenario, None, status="failed")
+        finally:
+            # Always acknowledge, even on failure: the monitor's flow control waits for it
+            ack_msg = {
+                "msg_id": f"incentives-ack-{index}",
+                "from": "incentives",
+                "to": "monitor",
+                "type": "consumer_processed",
+                "payload": {
+                    "consumer_id": consumer["consumer_id"],
+                    "scenario": scenario,
+                    "processed_index": index,
+                },
+            }
+            with telemetry.timed(
+                "incentives.emit", "agents.emit.duration", {"event": "consumer_processed"}
+            ):
+                await self._create_emitter().emit("consumer_processed", ack_msg)
+            print_colored(
+                f"[Incentives] > Acknowledged processing of {consumer['consumer_id']}",
+                Colors.OKGREEN,
+            )
+        return scenario
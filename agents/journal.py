@@ -0,0 +1,214 @@
+"""Durable run journal, so an interrupted run resumes instead of re-sending every letter.
+
+Every delivered notification is recorded as (run_id, shard, consumer_id, scenario,
+message hash, status) in a SQLite file (RUN_JOURNAL_PATH, default data/run_journal.db).
+Records are buffered and written in batches of `batch_size`, so a hard crash re-sends at
+most one batch (at-least-once delivery).
+
+Consumers stream in consumer_id order and notifications are delivered in arrival order,
+so the checkpoint of a run/shard is the highest journaled consumer_id below its first
+failed delivery: everything up to it was sent. A resumed run asks MCP for the consumers
+after the checkpoint, which retries the failed ones. Consumers after the first failure
+that were already sent are skipped (is_done).
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.getenv("RUN_JOURNAL_PATH") or os.path.join(
+    os.path.dirname(__file__), "../data/run_journal.db"
+)
+BATCH_SIZE = int(os.getenv("RUN_JOURNAL_BATCH", "500"))
+
+
+def message_hash(message):
+    return hashlib.sha256((message or "").encode("utf-8")).hexdigest()[:16]
+
+
+class RunJournal:
+    """Journal of one run (optionally one shard of it). Safe to share between threads;
+    several processes can write different shards of the same file."""
+
+    def __init__(self, run_id, shard=0, path=DEFAULT_PATH, batch_size=BATCH_SIZE):
+        self.run_id = run_id
+        self.shard = shard
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._conn = None
+        self.checkpoint = None
+        self.done = 0
+        self.failed = 0
+        # sent consumers after the first failed one; the checkpoint cannot move past those
+        self._sent_after = set()
+        self._load()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = connect(self.path)
+        return self._conn
+
+    def _load(self):
+        db, key = self._db(), (self.run_id, self.shard)
+        first_failed, self.failed = db.execute(
+            """SELECT MIN(consumer_id), COUNT(*) FROM run_journal
+               WHERE run_id = ? AND shard = ? AND status != 'sent'""",
+            key,
+        ).fetchone()
+        # '\uffff' sorts after every consumer_id, so without failures nothing is excluded
+        before = first_failed or "\uffff"
+        self.checkpoint, self.done = db.execute(
+            """SELECT MAX(consumer_id), COUNT(*) FROM run_journal
+               WHERE run_id = ? AND shard = ? AND consumer_id < ?""",
+            key + (before,),
+        ).fetchone()
+        if first_failed is not None:
+            self._sent_after = {
+                row[0]
+                for row in db.execute(
+                    """SELECT consumer_id FROM run_journal WHERE run_id = ? AND shard = ?
+                       AND consumer_id > ? AND status = 'sent'""",
+                    key + (first_failed,),
+                )
+            }
+
+    def is_done(self, consumer_id):
+        """True for consumers already sent in this run: at or before the checkpoint, or
+        sent after a failed one."""
+        if self.checkpoint is not None and consumer_id <= self.checkpoint:
+            return True
+        return consumer_id in self._sent_after
+
+    def record(self, consumer_id, scenario, message, status="sent"):
+        with self._lock:
+            self._pending.append(
+                (
+                    self.run_id,
+                    self.shard,
+                    consumer_id,
+                    scenario,
+                    message_hash(message),
+                    status,
+                    time.time(),
+                )
+            )
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        db = self._db()
+        with db:
+            db.executemany(
+                """INSERT OR REPLACE INTO run_journal
+                              (run_id, shard, consumer_id, scenario, message_hash, status, recorded_at)
+                              VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                self._pending,
+            )
+            db.execute(
+                "UPDATE runs SET updated_at = ? WHERE run_id = ?", (time.time(), self.run_id)
+            )
+        for row in self._pending:
+            # rows arrive in consumer_id order: the checkpoint stops at the first failure
+            if row[5] != "sent":
+                self.failed += 1
+            elif not self.failed:
+                self.checkpoint = max(self.checkpoint or "", row[2])
+                self.done += 1
+        self._pending = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def connect(path=DEFAULT_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        shard_count INTEGER NOT NULL DEFAULT 1,
+        status TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS run_journal (
+        run_id TEXT NOT NULL,
+        shard INTEGER NOT NULL,
+        consumer_id TEXT NOT NULL,
+        scenario TEXT,
+        message_hash TEXT,
+        status TEXT NOT NULL,
+        recorded_at REAL NOT NULL,
+        PRIMARY KEY (run_id, shard, consumer_id)
+    ) WITHOUT ROWID;
+    """)
+    return conn
+
+
+def start_run(run_id=None, shard_count=1, resume=True, path=DEFAULT_PATH):
+    """Run id to use: `run_id` if given (resumed when it exists), else the latest
+    unfinished run with the same shard count when `resume`, else a new run.
+    Returns (run_id, resumed)."""
+    conn = connect(path)
+    try:
+        with conn:
+            if run_id is None and resume:
+                row = conn.execute(
+                    """SELECT run_id FROM runs WHERE status = 'running' AND shard_count = ?
+                                      ORDER BY started_at DESC LIMIT 1""",
+                    (shard_count,),
+                ).fetchone()
+                run_id = row[0] if row else None
+            if run_id is not None:
+                row = conn.execute(
+                    "SELECT shard_count FROM runs WHERE run_id = ?", (run_id,)
+                ).fetchone()
+                if row is not None:
+                    if row[0] != shard_count:
+                        # checkpoints are per shard: another partitioning would skip the wrong consumers
+                        raise ValueError(
+                            f"run {run_id} was started with {row[0]} shard(s), not {shard_count}"
+                        )
+                    conn.execute(
+                        "UPDATE runs SET status = 'running', updated_at = ? WHERE run_id = ?",
+                        (time.time(), run_id),
+                    )
+                    return run_id, True
+            run_id = run_id or time.strftime("%Y%m%d-%H%M%S-") + os.urandom(3).hex()
+            now = time.time()
+            conn.execute(
+                "INSERT INTO runs (run_id, shard_count, status, started_at, updated_at) VALUES (?, ?, 'running', ?, ?)",
+                (run_id, shard_count, now, now),
+            )
+            return run_id, False
+    finally:
+        conn.close()
+
+
+def finish_run(run_id, path=DEFAULT_PATH):
+    """Mark a run complete, so the next start begins a new run instead of resuming it."""
+    conn = connect(path)
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE runs SET status = 'complete', updated_at = ? WHERE run_id = ?",
+                (time.time(), run_id),
+            )
+    finally:
+        conn.close()
@@ -0,0 +1,50 @@
+import asyncio
+
+from beeai_framework.emitter.emitter import Emitter
+
+from agents.energy_monitor_beeai import DEFAULT_MAX_IN_FLIGHT, EnergyMonitorAgent
+from agents.incentives_beeai import IncentivesAgent
+from llm.watson_client import LLM_BATCH_SIZE, LLM_CONCURRENCY
+
+
+def default_max_in_flight():
+    # enough credits to keep every LLM worker busy with full batches
+    return max(DEFAULT_MAX_IN_FLIGHT, LLM_CONCURRENCY * LLM_BATCH_SIZE)
+
+
+async def run_pipeline(mcp_client, emitter=None, max_in_flight=None, shard=None, journal=None):
+    """Run monitor and incentives on one event loop over a shared emitter.
+
+    Both agents must share a loop: the monitor's flow-control credits are released from
+    the incentives agent's 'consumer_processed' emits, so throughput follows the slower
+    stage instead of fixed sleeps. `shard` = (index, count) limits the run to one slice.
+    With a `journal` (agents.journal.RunJournal) deliveries are recorded and a resumed run
+    continues after its checkpoint.
+    """
+    if emitter is None:
+        emitter = Emitter()
+    if max_in_flight is None:
+        max_in_flight = default_max_in_flight()
+    monitor = EnergyMonitorAgent(
+        name="monitor",
+        mcp_client=mcp_client,
+        db_path=None,
+        max_in_flight=max_in_flight,
+        shard=shard,
+        journal=journal,
+    )
+    incentives = IncentivesAgent(name="incentives", mcp_client=mcp_client, journal=journal)
+    monitor._emitter = emitter
+    incentives._emitter = emitter
+    await asyncio.gather(monitor.loop_monitor(), incentives.loop_incentives())
+    return monitor, incentives
+
+
+def run_complete(monitor, incentives):
+    """True when every consumer was delivered: the stream was read to the end, every
+    consumer was acknowledged and no delivery failed. Only then may a run be finished."""
+    return (
+        monitor.error is None
+        and not incentives.failed
+        and monitor.resumed + monitor.processed_consumers == monitor.total_consumers
+    )
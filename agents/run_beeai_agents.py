@@ -1,36 +1,42 @@
-import os, time, threading
+import asyncio
+import logging
+import os
+import sys
+
 from dotenv import load_dotenv
+
 load_dotenv()
 
-# regenerate mock DB so every run has fresh data
-import logging
-import sys
-import os
+# project imports follow load_dotenv and the sys.path setup: their module-level settings read .env
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
-logging.info("Regenerating mock DB...")
-import scripts.generate_mock_db as gen_db
-gen_db.create_db()
-logging.info("Mock DB regenerated.")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+import scripts.generate_mock_db as gen_db  # noqa: E402
+from mcp.mcp_client import MCPClient  # noqa: E402
+from observability import telemetry  # noqa: E402
+from scripts.ingest import ensure_db  # noqa: E402
+
+# make sure the DB exists (seeded with mock data on first run; REGENERATE_DB=true forces fresh data)
+if os.getenv("REGENERATE_DB", "false").lower() == "true":
+    logging.info("Regenerating mock DB...")
+    gen_db.create_db()
+    logging.info("Mock DB regenerated.")
+else:
+    ensure_db()
+
+telemetry.setup("energy-optimizer")
 
 # start MCP client (spawns mcp_server as subprocess)
-from mcp.mcp_client import MCPClient
-mcp = MCPClient(server_py=os.path.join(os.path.dirname(__file__), '../mcp/mcp_server.py'))
+mcp = MCPClient(server_py=os.path.join(os.path.dirname(__file__), "../mcp/mcp_server.py"))
 
 # Try to use BeeAI agent implementations
 try:
-    from agents.energy_monitor_beeai import run_monitor
-    from agents.incentives_beeai import run_incentives
+    from agents.pipeline import run_pipeline
+
     print("Starting BeeAI agents (monitor + incentives)...")
-    # run both agents in separate threads since run_agent may block
-    t1 = threading.Thread(target=run_monitor, args=(mcp, None), daemon=True)
-    t2 = threading.Thread(target=run_incentives, args=(mcp,), daemon=True)
-    t1.start()
-    t2.start()
-    # keep main alive
-    while True:
-        time.sleep(0.5)
+    # both agents share one event loop so the monitor can wait on the incentives acks
+    asyncio.run(run_pipeline(mcp))
 except Exception as e:
     print("BeeAI runtime or agents failed to start:", e)
     print("Ensure 'beeai-framework' is installed and available.")
+finally:
     mcp.close()
@@ -0,0 +1,16 @@
+"""Discount scenario names and the usage threshold, shared by the agents and the MCP server.
+
+Kept free of NumPy so the server can import it without slowing its startup.
+"""
+
+# Scenario codes index into this tuple; the order is also the order used for counts.
+SCENARIOS = (
+    "10_percent",
+    "5_percent_efficient",
+    "5_percent_solar",
+    "no_discount_low_usage",
+    "high_usage",
+)
+
+# Average daily kWh at or above which a consumer is high usage (no discount)
+USAGE_THRESHOLD_KWH = 4.0
@@ -0,0 +1,118 @@
+"""Sharded execution: the neighbourhood is hash-partitioned by consumer_id across worker
+processes, each running its own MCP server connection, monitor and incentives agent.
+
+Partitioning happens in the MCP server (crc32(consumer_id) % workers, see
+mcp_server.shard_of), so every worker only decodes its own consumers. The coordinator
+merges the per-shard summaries. Each shard's per-consumer output (the letters) goes to its
+own file under SHARD_OUTPUT_DIR (default data/shards), since several processes writing to
+one terminal would interleave.
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+OUTPUT_DIR = os.getenv("SHARD_OUTPUT_DIR") or os.path.join(
+    os.path.dirname(__file__), "../data/shards"
+)
+
+
+def shard_output_path(tag, index, output_dir=OUTPUT_DIR):
+    """File a shard's letters are written to; `tag` is the run id (or start time)."""
+    return os.path.join(output_dir, f"{tag}-shard{index}.log")
+
+
+def run_shard(index, count, max_in_flight=None, timeout=None, output=None, run_id=None):
+    """Worker process entry point: process one shard, return its summary dict. Letters go
+    to the `output` file (appended, so a resumed run continues it), or to stdout without
+    one. With a `run_id` the shard journals its deliveries and resumes after its own
+    checkpoint."""
+    from agents.journal import RunJournal
+    from agents.pipeline import run_complete, run_pipeline
+    from mcp.mcp_client import MCPClient
+    from observability import telemetry
+
+    telemetry.setup("energy-optimizer-shard")
+    started = time.perf_counter()
+    journal = RunJournal(run_id, shard=index) if run_id else None
+    resumed = journal.done if journal else 0
+    mcp = MCPClient()
+    try:
+        if output:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        sink = open(output, "a", encoding="utf-8") if output else contextlib.nullcontext(sys.stdout)
+        with sink as out, contextlib.redirect_stdout(out):
+            monitor, incentives = asyncio.run(
+                asyncio.wait_for(
+                    run_pipeline(
+                        mcp, max_in_flight=max_in_flight, shard=(index, count), journal=journal
+                    ),
+                    timeout,
+                )
+            )
+    finally:
+        mcp.close()
+        if journal:
+            journal.close()
+        telemetry.shutdown()
+    return {
+        "shard": index,
+        "output": output,
+        "resumed": resumed,
+        "total_consumers": monitor.total_consumers,
+        "processed_consumers": monitor.processed_consumers,
+        "failed": incentives.failed,
+        "error": None if monitor.error is None else str(monitor.error),
+        "complete": run_complete(monitor, incentives),
+        "scenarios": dict(incentives.scenarios),
+        "elapsed": round(time.perf_counter() - started, 3),
+    }
+
+
+def merge_summaries(summaries):
+    """Coordinator view of all shards: summed totals and scenario counts."""
+    merged = {
+        "shards": len(summaries),
+        "total_consumers": 0,
+        "processed_consumers": 0,
+        "resumed": 0,
+        "failed": 0,
+        "complete": all(s["complete"] for s in summaries),
+        "scenarios": {},
+        "elapsed": max((s["elapsed"] for s in summaries), default=0.0),
+    }
+    for summary in summaries:
+        merged["total_consumers"] += summary["total_consumers"]
+        merged["processed_consumers"] += summary["processed_consumers"]
+        merged["resumed"] += summary.get("resumed", 0)
+        merged["failed"] += summary["failed"]
+        for scenario, n in summary["scenarios"].items():
+            merged["scenarios"][scenario] = merged["scenarios"].get(scenario, 0) + n
+    return merged
+
+
+def run_sharded(
+    workers, max_in_flight=None, timeout=None, quiet=True, run_id=None, output_dir=OUTPUT_DIR
+):
+    """Run `workers` shards in parallel processes; returns (merged, per-shard summaries).
+    With `quiet` every shard writes its letters to shard_output_path() instead of stdout.
+
+    Workers are spawned rather than forked: the parent may already run threads (LLM
+    prewarm, telemetry exporters) that a fork would copy in an undefined state.
+    """
+    tag = run_id or time.strftime("%Y%m%d-%H%M%S")
+    outputs = [shard_output_path(tag, i, output_dir) if quiet else None for i in range(workers)]
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [
+            pool.submit(run_shard, i, workers, max_in_flight, timeout, outputs[i], run_id)
+            for i in range(workers)
+        ]
+        summaries = [f.result() for f in futures]
+    return merge_summaries(summaries), summaries
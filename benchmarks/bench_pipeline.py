@@ -0,0 +1,244 @@
+"""End-to-end benchmark of the monitor -> incentives pipeline.
+
+For every dataset size a database is generated (scripts/generate_mock_db.generate) and a
+child process runs the real MCPClient/mcp_server and both agents against it with the
+mock LLM. A separate process per size keeps peak RSS numbers independent. Results are
+written as JSON, ready for benchmarks/compare.py.
+
+    python benchmarks/bench_pipeline.py --sizes 1000,10000,100000 [--mode template] [--output FILE]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_SIZES = "1000,10000"
+RTT_SAMPLES = 500
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def latency_stats(seconds):
+    """p50/p99/mean/max in milliseconds."""
+    ms = [s * 1000.0 for s in seconds]
+    return {
+        "p50_ms": round(percentile(ms, 50), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 99), 3) if ms else None,
+        "mean_ms": round(statistics.fmean(ms), 3) if ms else None,
+        "max_ms": round(max(ms), 3) if ms else None,
+    }
+
+
+def _peak_rss_kb(who):
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measure_rtt(mcp, samples=RTT_SAMPLES):
+    """Round-trip times of small get_consumer_summary requests (one row each)."""
+    times = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        mcp.request({"cmd": "get_consumer_summary", "limit": 1})
+        times.append(time.perf_counter() - started)
+    return times
+
+
+async def run_agents(mcp, max_in_flight):
+    from beeai_framework.emitter.emitter import Emitter
+
+    from agents.pipeline import run_pipeline
+
+    emitter = Emitter()
+    sent, done = {}, {}
+
+    # registered before the agents subscribe, so these run first on every emit
+    async def on_sent(msg, event):
+        sent[msg["payload"]["consumer_index"]] = time.perf_counter()
+
+    async def on_done(msg, event):
+        done[msg["payload"]["processed_index"]] = time.perf_counter()
+
+    emitter.on("consumer_data", on_sent)
+    emitter.on("consumer_processed", on_done)
+    monitor, _ = await run_pipeline(mcp, emitter, max_in_flight)
+    latencies = [done[i] - sent[i] for i in done if i in sent]
+    return monitor.total_consumers, latencies
+
+
+def run_child(db, rtt_samples, max_in_flight):
+    """Benchmark one database in this process; returns the result dict."""
+    os.environ["MCP_DB_PATH"] = db
+    from mcp.mcp_client import MCPClient
+
+    started = time.perf_counter()
+    mcp = MCPClient()
+    # startup = spawn + first answered request (server imports, DB open)
+    mcp.request({"cmd": "get_consumer_summary", "limit": 1}, timeout=60)
+    startup = time.perf_counter() - started
+    try:
+        rtt = measure_rtt(mcp, rtt_samples)
+        started = time.perf_counter()
+        # imported only to time it: agent/LLM module imports are startup, not pipeline time
+        import agents.pipeline  # noqa: F401
+
+        agent_import = time.perf_counter() - started
+        started = time.perf_counter()
+        # the agents print every consumer; keep the terminal out of the measurement
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            total, latencies = asyncio.run(run_agents(mcp, max_in_flight))
+        elapsed = time.perf_counter() - started
+    finally:
+        mcp.close()
+        mcp.proc.wait()
+    return {
+        "consumers": total,
+        "processed": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "consumers_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "consumer_latency": latency_stats(latencies),
+        "mcp_rtt": latency_stats(rtt),
+        "startup_s": round(startup, 3),
+        "agent_import_s": round(agent_import, 3),
+        "peak_rss_kb": {
+            "client": _peak_rss_kb(resource.RUSAGE_SELF),
+            "server": _peak_rss_kb(resource.RUSAGE_CHILDREN),
+        },
+    }
+
+
+def prepare_db(data_dir, size, days, seed):
+    """Generated database for `size` consumers, reused if it already exists in data_dir."""
+    from scripts.generate_mock_db import generate
+
+    path = os.path.join(data_dir, f"bench_{size}_{days}d_s{seed}.db")
+    if not os.path.exists(path):
+        started = time.time()
+        rows = generate(path, consumers=size, days=days, seed=seed)
+        print(f"generated {path} ({rows} rows) in {time.time() - started:.1f}s", file=sys.stderr)
+    return path
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the monitor -> incentives pipeline")
+    parser.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        help="comma-separated consumer counts (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--days", type=int, default=10, help="days of readings per consumer (default: %(default)s)"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--mode",
+        default="hybrid",
+        choices=("template", "hybrid", "llm"),
+        help="NOTIFICATION_MODE for the run",
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, help="monitor credits (default: pipeline default)"
+    )
+    parser.add_argument("--rtt-samples", type=int, default=RTT_SAMPLES)
+    parser.add_argument(
+        "--data-dir", help="where generated databases are kept and reused (default: a temp dir)"
+    )
+    parser.add_argument(
+        "--output", help="JSON results path (default: benchmarks/results/<time>_<commit>.json)"
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        json.dump(run_child(args.child, args.rtt_samples, args.max_in_flight), sys.stdout)
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.makedirs(data_dir, exist_ok=True)
+    env = dict(os.environ, USE_WATSONX="false", LLM_CACHE="false", NOTIFICATION_MODE=args.mode)
+    runs = []
+    for size in sizes:
+        db = prepare_db(data_dir, size, args.days, args.seed)
+        cmd = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--child",
+            db,
+            "--rtt-samples",
+            str(args.rtt_samples),
+        ]
+        if args.max_in_flight:
+            cmd += ["--max-in-flight", str(args.max_in_flight)]
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            print(f"size {size} failed (exit {proc.returncode})", file=sys.stderr)
+            continue
+        result = dict(json.loads(proc.stdout), size=size)
+        runs.append(result)
+        latency, rss = result["consumer_latency"], result["peak_rss_kb"]
+        print(
+            f"{size:8d} consumers: {result['consumers_per_s']:8.1f} consumers/s  "
+            f"p50 {latency['p50_ms']} ms  p99 {latency['p99_ms']} ms  "
+            f"rtt p50 {result['mcp_rtt']['p50_ms']} ms  startup {result['startup_s']:.2f}s  "
+            f"rss {rss['client']}/{rss['server']} KiB",
+            file=sys.stderr,
+        )
+
+    report = {
+        "benchmark": "pipeline",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "days": args.days,
+            "seed": args.seed,
+            "mode": args.mode,
+            "max_in_flight": args.max_in_flight,
+            "rtt_samples": args.rtt_samples,
+        },
+        "runs": runs,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{report['commit'] or 'nogit'}.json"
+        )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
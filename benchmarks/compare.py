@@ -0,0 +1,63 @@
+"""Compare two benchmark result files (see bench_pipeline.py) size by size.
+
+python benchmarks/compare.py results/before.json results/after.json
+"""
+
+import argparse
+import json
+
+# (label, path into a run, True when higher is better)
+METRICS = (
+    ("consumers/s", ("consumers_per_s",), True),
+    ("latency p50 ms", ("consumer_latency", "p50_ms"), False),
+    ("latency p99 ms", ("consumer_latency", "p99_ms"), False),
+    ("mcp rtt p50 ms", ("mcp_rtt", "p50_ms"), False),
+    ("mcp rtt p99 ms", ("mcp_rtt", "p99_ms"), False),
+    ("startup s", ("startup_s",), False),
+    ("agent import s", ("agent_import_s",), False),
+    ("client rss KiB", ("peak_rss_kb", "client"), False),
+    ("server rss KiB", ("peak_rss_kb", "server"), False),
+)
+
+
+def _get(run, path):
+    for key in path:
+        run = run.get(key) if isinstance(run, dict) else None
+    return run
+
+
+def compare(before, after):
+    """Rows of (size, label, old, new, change %, better?) for sizes present in both reports."""
+    old_runs = {r["size"]: r for r in before["runs"]}
+    rows = []
+    for run in after["runs"]:
+        old = old_runs.get(run["size"])
+        if old is None:
+            continue
+        for label, path, higher_better in METRICS:
+            a, b = _get(old, path), _get(run, path)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a * 100.0 if a else 0.0
+            better = change > 0 if higher_better else change < 0
+            rows.append((run["size"], label, a, b, change, better))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args(argv)
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"{args.before} ({before.get('commit')}) -> {args.after} ({after.get('commit')})")
+    for size, label, a, b, change, better in compare(before, after):
+        mark = "+" if better else ("-" if change else " ")
+        print(f"{size:9d}  {label:<16s} {a:12.3f} -> {b:12.3f}  {change:+7.1f}% {mark}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "../data/llm_cache.db")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    # whitespace-only differences should not produce a different cache entry
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def cache_key(model, prompt, params=None):
+    """Content address for an LLM call: sha256 over model id, normalized prompt and params."""
+    payload = json.dumps([model, normalize_prompt(prompt), params or {}], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier LLM response cache: an in-memory LRU in front of a SQLite table on disk.
+
+    Entries expire after `ttl` seconds on both tiers. The memory tier holds at most
+    `max_memory_entries`; the disk tier is pruned back to `max_disk_entries` (least
+    recently used first) every `prune_every` writes. Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_PATH,
+        ttl=30 * 86400,
+        max_memory_entries=1024,
+        max_disk_entries=100000,
+        prune_every=100,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.prune_every = prune_every
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _db(self):
+        if self._conn is None and self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                del self._memory[key]
+            db = self._db()
+            row = (
+                db.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if db
+                else None
+            )
+            if row is None or now - row[1] >= self.ttl:
+                self.misses += 1
+                return None
+            db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self.hits_disk += 1
+            return value
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            db = self._db()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                self._prune(db, now)
+            db.commit()
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _prune(self, db, now):
+        db.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,))
+        db.execute(
+            """
+        DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+        )""",
+            (self.max_disk_entries,),
+        )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (
+                    round((self.hits_memory + self.hits_disk) / lookups, 3) if lookups else 0.0
+                ),
+                "memory_entries": len(self._memory),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
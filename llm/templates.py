@@ -0,0 +1,93 @@
+"""Notification letters rendered from precompiled Jinja2 templates, one per discount scenario.
+
+Every scenario template extends one letter layout; an optional personal_note (a short
+LLM-written paragraph) is slotted in just before the sign-off.
+"""
+
+from jinja2 import DictLoader, Environment, StrictUndefined
+
+LETTER_LAYOUT = """Dear {{ consumer_id }},
+
+{% block body %}{% endblock %}
+{%- if personal_note %}
+
+{{ personal_note }}
+{%- endif %}
+
+-- Your Community Energy Team"""
+
+SCENARIO_BODIES = {
+    "10_percent": """Congratulations! Your average energy usage over the past month was {{ avg_kwh }} kWh/day, which is below the 4 kWh threshold.
+
+You are using Energy Efficient equipment and have produced solar energy. You are eligible for a 10% discount on your next bill!
+
+This is the highest discount tier available, recognizing your outstanding commitment to energy efficiency and renewable energy production. Your efforts are helping our community reduce carbon emissions and move toward a more sustainable future.
+
+Thank you for being a leader in energy conservation!""",
+    "5_percent_efficient": """Great news! Your average energy usage over the past month was {{ avg_kwh }} kWh/day, which is below the 4 kWh threshold.
+
+You are using Energy Efficient equipment. You are eligible for a 5% discount on your next bill!
+
+To qualify for an additional 5% discount (total 10%), consider installing solar panels. This would not only increase your savings but also contribute to our community's renewable energy goals.
+
+Keep up the great work with energy efficiency!""",
+    "5_percent_solar": """Excellent! Your average energy usage over the past month was {{ avg_kwh }} kWh/day, which is below the 4 kWh threshold.
+
+You have produced solar energy. You are eligible for a 5% discount on your next bill!
+
+To qualify for an additional 5% discount (total 10%), consider upgrading to Energy Efficient equipment. This combination of solar production and efficient appliances would maximize your savings and environmental impact.
+
+Your solar contribution is making a difference!""",
+    "no_discount_low_usage": """Your average energy usage over the past month was {{ avg_kwh }} kWh/day, which is below the 4 kWh threshold - great job on keeping your consumption low!
+
+However, you are not currently eligible for discounts. To qualify for discounts:
+
+• Install Energy Efficient equipment (5% discount)
+• Add solar panels (5% discount)
+• Or both for a 10% discount!
+
+You're already on the right track with low usage. These additional steps would help you save money while contributing to our community's sustainability goals.
+
+We're here to help you make these improvements!""",
+    "high_usage": """Your average energy usage over the past month was {{ avg_kwh }} kWh/day.
+
+To qualify for discounts and reduce your energy costs:
+
+• Reduce usage to below 4 kWh/day
+• Install Energy Efficient equipment (5% discount)
+• Add solar panels (5% discount)
+• Or all three for 10% discount!
+
+We understand that reducing energy usage can be challenging. Our team can provide personalized recommendations to help you achieve these goals. Small changes like using energy-efficient appliances, adjusting thermostat settings, and shifting high-usage activities to off-peak hours can make a significant difference.
+
+Let's work together to reduce your energy costs and environmental impact!""",
+    "default": """Your average energy usage over the past month was {{ avg_kwh }} kWh/day.
+
+We're here to help you optimize your energy consumption and potentially qualify for discounts. Our team can provide personalized energy efficiency recommendations based on your specific situation.
+
+Please contact us for a detailed energy audit and customized recommendations to help you save money and reduce your environmental impact.""",
+}
+
+
+def _sources():
+    sources = {"letter.txt": LETTER_LAYOUT}
+    for scenario, body in SCENARIO_BODIES.items():
+        sources[scenario + ".txt"] = (
+            "{% extends 'letter.txt' %}{% block body %}" + body + "{% endblock %}"
+        )
+    return sources
+
+
+_env = Environment(loader=DictLoader(_sources()), undefined=StrictUndefined, autoescape=False)
+# compiled once at import; rendering is then a plain Python function call per letter
+_TEMPLATES = {scenario: _env.get_template(scenario + ".txt") for scenario in SCENARIO_BODIES}
+
+
+def render_letter(scenario, consumer, personal_note=None):
+    """Full notification letter for a consumer dict (needs consumer_id and avg_kwh)."""
+    template = _TEMPLATES.get(scenario) or _TEMPLATES["default"]
+    return template.render(
+        consumer_id=consumer["consumer_id"],
+        avg_kwh=consumer["avg_kwh"],
+        personal_note=personal_note,
+    )
@@ -1,111 +1,351 @@
-import os
+import asyncio
+import contextvars
 import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from dotenv import load_dotenv
+
+from llm.cache import DEFAULT_PATH as DEFAULT_CACHE_PATH
+from llm.cache import ResponseCache, cache_key
+from observability import telemetry
+
 load_dotenv()
-USE_WATSONX = os.getenv('USE_WATSONX','false').lower() == 'true'
-MODEL = os.getenv('WATSONX_MODEL','ibm/granite-3-2-8b-instruct')
+USE_WATSONX = os.getenv("USE_WATSONX", "false").lower() == "true"
+MODEL = os.getenv("WATSONX_MODEL", "ibm/granite-3-2-8b-instruct")
+# Notification generation: requests kept in flight, max requests/second (0 = unlimited)
+# and retries for rate-limited (HTTP 429) calls
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_MAX_RPS = float(os.getenv("LLM_MAX_RPS", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# Consumers packed into one batched prompt (1 = one prompt per consumer), and the output
+# token budget requested per packed letter (callers pass their own for shorter items)
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+LLM_BATCH_TOKENS_PER_ITEM = int(os.getenv("LLM_BATCH_TOKENS_PER_ITEM", "400"))
+
+# Batched prompts: shared instructions once, then one delimited block per item. The model
+# is asked to start each answer with a LETTER marker so the output can be split back.
+BATCH_ITEM_MARKER = "--- CONSUMER {key} ---"
+BATCH_OUTPUT_MARKER = "=== LETTER {key} ==="
+_BATCH_ITEM_RE = re.compile(r"^--- CONSUMER (\S+) ---$", re.MULTILINE)
+_BATCH_OUTPUT_RE = re.compile(r"^=== LETTER (\S+) ===[ \t]*$", re.MULTILINE)
+# what the batch header asks for per item: whole letters, or hybrid mode's personal paragraphs
+BATCH_UNITS = {"letter": "one complete letter", "paragraph": "one personal paragraph"}
+
+# Response cache for real LLM calls (content-addressed, memory LRU + SQLite under data/)
+LLM_CACHE = os.getenv("LLM_CACHE", "true").lower() == "true"
+response_cache = (
+    ResponseCache(
+        path=os.getenv("LLM_CACHE_PATH") or DEFAULT_CACHE_PATH,
+        ttl=float(os.getenv("LLM_CACHE_TTL", str(30 * 86400))),
+        max_memory_entries=int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "1024")),
+        max_disk_entries=int(os.getenv("LLM_CACHE_DISK_ENTRIES", "100000")),
+    )
+    if LLM_CACHE
+    else None
+)
 
 # Debug logging
 logging.info(f"USE_WATSONX: {USE_WATSONX}")
 logging.info(f"WATSONX_MODEL: {MODEL}")
 
-prompt_templates = {
-    'incentive_notification_10_percent': """Dear {consumer_id},
-Congratulations! Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold.
-You are using Energy Efficient equipment and have produced solar energy. You are eligible for a 10% discount on your next bill!
-Thank you for helping the community reduce carbon emissions.
--- Your Community Energy Team""",
-
-    'incentive_notification_5_percent_efficient': """Dear {consumer_id},
-Great news! Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold.
-You are using Energy Efficient equipment. You are eligible for a 5% discount on your next bill!
-Consider installing solar panels to qualify for an additional 5% discount.
--- Your Community Energy Team""",
-
-    'incentive_notification_5_percent_solar': """Dear {consumer_id},
-Excellent! Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold.
-You have produced solar energy. You are eligible for a 5% discount on your next bill!
-Consider upgrading to Energy Efficient equipment to qualify for an additional 5% discount.
--- Your Community Energy Team""",
-
-    'incentive_notification_no_discount_low_usage': """Dear {consumer_id},
-Your average energy usage over the past month was {avg_kwh} kWh/day, which is below the 4 kWh threshold - great job!
-However, you are not currently eligible for discounts. To qualify for discounts:
-- Install Energy Efficient equipment (5% discount)
-- Add solar panels (5% discount)
-- Or both for a 10% discount!
--- Your Community Energy Team""",
-
-    'incentive_notification_high_usage': """Dear {consumer_id},
-Your average energy usage over the past month was {avg_kwh} kWh/day.
-To qualify for discounts and reduce your energy costs:
-- Reduce usage to below 4 kWh/day
-- Install Energy Efficient equipment (5% discount)
-- Add solar panels (5% discount)
-- Or all three for a 10% discount!
--- Your Community Energy Team""",
-
-    'recommendation': """Dear {consumer_id},
-Your average energy usage is {avg_kwh} kWh/day. Based on our analysis, we recommend: {recs}.
-Small changes like adopting energy-efficient appliances or shifting EV charging to daytime can reduce your bill.
--- Your Community Energy Team"""
-}
-
-if USE_WATSONX:
+# watsonx client age (seconds) after which it is rebuilt so its IAM token never goes stale
+WATSONX_CLIENT_TTL = float(os.getenv("WATSONX_CLIENT_TTL", "3000"))
+
+
+class MockLLM:
+    def generate(self, prompt, **kwargs):
+        if _BATCH_ITEM_RE.search(prompt):
+            # answer a batched prompt the way the model is asked to: one marked section per item
+            sections = _split_sections(prompt, _BATCH_ITEM_RE)
+            text = "\n".join(
+                BATCH_OUTPUT_MARKER.format(key=key) + "\n[MOCK LLM]\n" + body
+                for key, body in sections.items()
+            )
+            return {"results": [{"generated_text": text}]}
+        return {"results": [{"generated_text": "[MOCK LLM]\n" + prompt}]}
+
+
+def _build_client():
+    """Create the LLM client. For watsonx this imports the SDK and authenticates over the
+    network, which is why it only happens on first use (or in prewarm())."""
+    if not USE_WATSONX:
+        return MockLLM()
     try:
         from ibm_watsonx_ai.foundation_models import ModelInference
+
         # Check if credentials are available
-        api_key = os.getenv('WATSONX_API_KEY') or os.getenv('WATSONX_APIKEY')
-        project_id = os.getenv('WATSONX_PROJECT_ID')
-        
+        api_key = os.getenv("WATSONX_API_KEY") or os.getenv("WATSONX_APIKEY")
+        project_id = os.getenv("WATSONX_PROJECT_ID")
+
         # Debug logging
         logging.info(f"API Key found: {bool(api_key)}")
         logging.info(f"Project ID found: {bool(project_id)}")
-        
+
         if not api_key:
             logging.warning("WATSONX_API_KEY environment variable is not set, using mock client")
-            client = None
-        elif not project_id:
+            return None
+        if not project_id:
             logging.warning("WATSONX_PROJECT_ID environment variable is not set, using mock client")
-            client = None
-        else:
-            logging.info("Initializing Watsonx ModelInference client...")
-            # Initialize with credentials dict
-            try:
-                credentials = {
-                    "apikey": api_key,
-                    "url": os.getenv('WATSONX_URL', 'https://us-south.ml.cloud.ibm.com')
-                }
-                client = ModelInference(
-                    model_id=MODEL,
-                    project_id=project_id,
-                    credentials=credentials
-                )
-                logging.info("Watsonx client initialized successfully with credentials dict")
-            except Exception as e:
-                logging.warning(f"Watsonx initialization failed: {e}")
-                client = None
+            return None
+        logging.info("Initializing Watsonx ModelInference client...")
+        credentials = {
+            "apikey": api_key,
+            "url": os.getenv("WATSONX_URL", "https://us-south.ml.cloud.ibm.com"),
+        }
+        client = ModelInference(model_id=MODEL, project_id=project_id, credentials=credentials)
+        logging.info("Watsonx client initialized successfully with credentials dict")
+        return client
     except Exception as e:
-        logging.warning('Watsonx init failed: %s', e)
-        client = None
-else:
-    class MockLLM:
-        def generate(self, prompt, **kwargs):
-            return {'results':[{'generated_text': '[MOCK LLM]\n' + prompt}]}
-    client = MockLLM()
-
-def generate_prompt(prompt):
+        logging.warning("Watsonx init failed: %s", e)
+        return None
+
+
+# (client, created) as one tuple, so readers never see a client without its creation time
+_client_state = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The shared LLM client, created on first call; None when watsonx is enabled but
+    unusable. Thread-safe: concurrent first callers wait for a single initialization."""
+    global _client_state
+    state = _client_state
+    if state is not None and not _client_expired(state[1]):
+        return state[0]
+    with _client_lock:
+        state = _client_state
+        if state is None or _client_expired(state[1]):
+            state = _client_state = (_build_client(), time.monotonic())
+        return state[0]
+
+
+def _client_expired(created):
+    return (
+        USE_WATSONX and WATSONX_CLIENT_TTL > 0 and time.monotonic() - created > WATSONX_CLIENT_TTL
+    )
+
+
+def reset_client(stale=None):
+    """Drop the shared client so the next get_client() re-authenticates. When `stale` is
+    given, only drop it if it is still the current client (another thread may already
+    have replaced it)."""
+    global _client_state
+    with _client_lock:
+        if _client_state is not None and (stale is None or stale is _client_state[0]):
+            _client_state = None
+
+
+def prewarm():
+    """Build the client on a background thread so the first notification does not pay for
+    the SDK import and authentication. Returns the thread."""
+    thread = threading.Thread(target=get_client, name="llm-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def _is_rate_limited(exc):
+    text = str(exc).lower()
+    return "429" in text or "rate limit" in text or "too many requests" in text
+
+
+def _is_auth_error(exc):
+    text = str(exc).lower()
+    return "401" in text or "unauthorized" in text or ("token" in text and "expired" in text)
+
+
+def _cache_active():
+    # only real model output is worth caching; mock responses are free to regenerate
+    return response_cache is not None and USE_WATSONX and get_client() is not None
+
+
+def generate_prompt(prompt, params=None):
+    if not _cache_active():
+        return _generate(prompt, params)
+    key = cache_key(MODEL, prompt, params)
+    cached = response_cache.get(key)
+    telemetry.counter("llm.cache.lookups").add(1, {"hit": cached is not None})
+    if cached is not None:
+        return cached
+    resp = _generate(prompt, params)
+    if _is_real_response(resp):
+        response_cache.put(key, resp)
+    return resp
+
+
+def _is_real_response(resp):
+    text = (
+        resp["results"][0].get("generated_text", "")
+        if isinstance(resp, dict) and resp.get("results")
+        else ""
+    )
+    return bool(text.strip()) and not text.startswith("[MOCK LLM")
+
+
+def _generate(prompt, params=None, items=1):
+    with telemetry.timed(
+        "llm.generate", "llm.latency", {"llm.model": MODEL, "llm.items": items}
+    ) as span:
+        resp = _call_model(prompt, params)
+        text = resp["results"][0].get("generated_text", "") if resp.get("results") else ""
+        span.set_attribute("llm.mock", text.startswith("[MOCK LLM"))
+        return resp
+
+
+def _call_model(prompt, params=None):
+    client = get_client()
     if USE_WATSONX and client:
-        try:
-            # Use the correct parameters for IBM Watsonx AI
-            resp = client.generate(prompt=prompt)
-            return resp
-        except Exception as e:
-            logging.warning(f'Watsonx generate failed: {e}, using mock response')
-            return {'results':[{'generated_text': '[MOCK LLM - Watsonx failed]\n' + prompt}]}
+        refreshed = False
+        attempt = 0
+        while True:
+            try:
+                # Use the correct parameters for IBM Watsonx AI
+                if params:
+                    resp = client.generate(prompt=prompt, params=params)
+                else:
+                    resp = client.generate(prompt=prompt)
+                return resp
+            except Exception as e:
+                if attempt < LLM_MAX_RETRIES and _is_rate_limited(e):
+                    # back off exponentially when the provider throttles us
+                    time.sleep(0.5 * 2**attempt)
+                    attempt += 1
+                    continue
+                if not refreshed and _is_auth_error(e):
+                    # token expired or revoked: re-authenticate once and retry
+                    reset_client(client)
+                    client = get_client()
+                    refreshed = True
+                    if client:
+                        continue
+                logging.warning(f"Watsonx generate failed: {e}, using mock response")
+                return {"results": [{"generated_text": "[MOCK LLM - Watsonx failed]\n" + prompt}]}
     else:
         # Use mock client when Watsonx is disabled or client is None
         if client is None:
-            return {'results':[{'generated_text': '[MOCK LLM - No client]\n' + prompt}]}
+            return {"results": [{"generated_text": "[MOCK LLM - No client]\n" + prompt}]}
         return client.generate(prompt)
 
+
+class RateLimiter:
+    """Spaces async callers at most `rate` per second (rate <= 0 disables the limit)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = 0.0
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # no await between reading and updating _next, so this is safe within one event loop
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + 1.0 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+rate_limiter = RateLimiter(LLM_MAX_RPS)
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, LLM_CONCURRENCY), thread_name_prefix="llm"
+        )
+    return _executor
+
+
+async def agenerate_prompt(prompt, params=None):
+    """generate_prompt for asyncio callers: rate-limited and run on the LLM worker pool
+    so the blocking HTTP call never stalls the event loop."""
+    await rate_limiter.acquire()
+    return await _run_on_pool(generate_prompt, prompt, params)
+
+
+def _run_on_pool(fn, *args):
+    # copy the caller's context so telemetry spans on the worker nest under the caller's span
+    ctx = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(_get_executor(), ctx.run, fn, *args)
+
+
+def _split_sections(text, marker_re):
+    """{key: body} for every marker line in text (text before the first marker is dropped)."""
+    matches = list(marker_re.finditer(text))
+    sections = {}
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections[m.group(1)] = text[m.end() : end].strip()
+    return sections
+
+
+def build_batch_prompt(instructions, items, unit="letter"):
+    """Pack (key, details) items behind one copy of the shared instructions; `unit` is
+    what is written per item ('letter' or 'paragraph')."""
+    parts = [
+        instructions.strip(),
+        "",
+        f"Write {BATCH_UNITS[unit]} for EACH consumer below, in the same order.",
+        f'Begin each {unit} with a line "'
+        + BATCH_OUTPUT_MARKER.format(key="<consumer id>")
+        + '" and write nothing before the first one.',
+        "",
+    ]
+    for key, details in items:
+        parts.append(BATCH_ITEM_MARKER.format(key=key))
+        parts.append(details.strip())
+        parts.append("")
+    return "\n".join(parts)
+
+
+def split_batch_response(resp, keys):
+    """Split a batched generate response into one single-prompt-shaped response per key.
+    Items the model skipped come back with empty text so callers fall back for just those."""
+    text = ""
+    if isinstance(resp, dict) and resp.get("results"):
+        text = resp["results"][0].get("generated_text", "")
+    sections = _split_sections(text, _BATCH_OUTPUT_RE)
+    return [{"results": [{"generated_text": sections.get(key, "")}]} for key in keys]
+
+
+def generate_batch(instructions, items, unit="letter", tokens_per_item=None):
+    """One LLM call for many (key, details) items sharing the same instructions; returns
+    a list of responses aligned with items, each shaped like generate_prompt's.
+    Items are cached individually, so only cache misses are packed into the prompt.
+    The output budget is `tokens_per_item` (default LLM_BATCH_TOKENS_PER_ITEM) per item."""
+    results = [None] * len(items)
+    cache_keys = [None] * len(items)
+    missing = list(range(len(items)))
+    tokens_per_item = tokens_per_item or LLM_BATCH_TOKENS_PER_ITEM
+    if _cache_active():
+        # keyed on what shapes each answer: what was asked for and its token budget
+        key_params = {"batched": True, "unit": unit, "tokens_per_item": tokens_per_item}
+        cache_keys = [
+            cache_key(MODEL, instructions + "\n" + details, key_params) for _, details in items
+        ]
+        missing = []
+        for i, key in enumerate(cache_keys):
+            results[i] = response_cache.get(key)
+            telemetry.counter("llm.cache.lookups").add(1, {"hit": results[i] is not None})
+            if results[i] is None:
+                missing.append(i)
+    if missing:
+        batch = [items[i] for i in missing]
+        params = {"max_new_tokens": tokens_per_item * len(batch)}
+        resp = _generate(build_batch_prompt(instructions, batch, unit), params, items=len(batch))
+        for i, item_resp in zip(missing, split_batch_response(resp, [key for key, _ in batch])):
+            results[i] = item_resp
+            if cache_keys[i] and _is_real_response(item_resp):
+                response_cache.put(cache_keys[i], item_resp)
+    return results
+
+
+async def agenerate_batch(instructions, items, unit="letter", tokens_per_item=None):
+    """generate_batch on the LLM worker pool (one rate-limiter slot per batch)."""
+    await rate_limiter.acquire()
+    return await _run_on_pool(generate_batch, instructions, items, unit, tokens_per_item)
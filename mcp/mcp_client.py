@@ -1,60 +1,312 @@
-import subprocess, sys, json, threading, queue, os, time
+import asyncio
+import itertools
 import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp import wire
+from observability import telemetry
+
+# chunks a stream may have in flight before the server waits for the caller to take one
+STREAM_WINDOW = int(os.getenv("MCP_STREAM_WINDOW", "4"))
+
 
 class MCPClientError(Exception):
     pass
 
+
+def _default_server_py():
+    return os.path.join(os.path.dirname(__file__), "mcp_server.py")
+
+
+class _Stream:
+    """Pending entry for a streaming request: every reply message is pushed to `put`."""
+
+    def __init__(self, put):
+        self.put = put
+
+
+def _drop(msg):
+    pass
+
+
+def _credit(req_id):
+    return {"cmd": "stream_credit", "stream_id": req_id, "credits": 1}
+
+
+def _cancel(req_id):
+    return {"cmd": "stream_cancel", "stream_id": req_id}
+
+
+def _is_last(resp):
+    return resp.get("end") or not resp.get("ok")
+
+
+def _stream_message(msg):
+    """Unwrap one streamed message: raises on errors, returns None at the end marker."""
+    if isinstance(msg, Exception):
+        raise msg
+    if not msg.get("ok"):
+        raise MCPClientError(f"server error: {msg.get('error')}")
+    if msg.get("end"):
+        return None
+    return msg
+
+
+def _traced(payload):
+    """With telemetry on, attach the trace context and ask the server for its timings."""
+    carrier = telemetry.inject()
+    if carrier is None:
+        return payload
+    return dict(payload, trace=carrier, timing=True)
+
+
+def _record_reply(span, cmd, started, resp):
+    """Split a round trip into server time (queue + handling) and pipe/transport time.
+    For streams `resp` is the end marker and the duration covers the whole stream."""
+    if not telemetry.enabled():
+        return
+    elapsed = (time.perf_counter() - started) * 1000.0
+    attrs = {"mcp.cmd": str(cmd)}
+    telemetry.histogram("mcp.client.duration").record(elapsed, attrs)
+    timing = resp.get("timing") if isinstance(resp, dict) else None
+    if timing:
+        server_ms = timing.get("queue_ms", 0.0) + timing.get("handle_ms", 0.0)
+        telemetry.histogram("mcp.client.transport").record(max(0.0, elapsed - server_ms), attrs)
+        if span is not None:
+            span.set_attributes({f"mcp.server.{key}": value for key, value in timing.items()})
+
+
 class MCPClient:
-    def __init__(self, server_py=None):
+    """Multiplexed stdio client: every request carries an 'id' that the server echoes,
+    replies are routed to per-request futures, so many calls can be in flight at once.
+    framing='msgpack' negotiates length-prefixed msgpack frames instead of JSON lines."""
+
+    def __init__(self, server_py=None, framing="json"):
         if server_py is None:
-            server_py = os.path.join(os.path.dirname(__file__), 'mcp_server.py')
-        self.proc = subprocess.Popen([sys.executable, server_py],
-                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                     text=True, bufsize=1)
-        self._lock = threading.Lock()
-        self._responses = queue.Queue()
+            server_py = _default_server_py()
+        self.proc = subprocess.Popen(
+            [sys.executable, server_py],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._read_framing = self._write_framing = "json"
+        # only the pipe write is serialized; waiting for the reply happens outside any lock
+        self._write_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._closed = False
         self._reader = threading.Thread(target=self._read_loop, daemon=True)
         self._reader.start()
         self._stderr_reader = threading.Thread(target=self._stderr_loop, daemon=True)
         self._stderr_reader.start()
+        if framing != "json":
+            self._negotiate(framing)
+
+    def _negotiate(self, framing):
+        if framing not in wire.available_framings():
+            logging.warning(
+                "[MCP client] %s framing not available locally, staying on JSON lines", framing
+            )
+            return
+        resp = self.request({"cmd": "negotiate", "framing": framing})
+        if resp.get("ok"):
+            self._write_framing = framing
+        else:
+            logging.warning(
+                "[MCP client] server refused %s framing: %s", framing, resp.get("error")
+            )
 
     def _read_loop(self):
-        for line in self.proc.stdout:
-            line = line.strip()
-            if not line: continue
+        while True:
             try:
-                resp = json.loads(line)
-            except:
-                resp = {'ok': False, 'error': 'invalid_json', 'raw': line}
-            self._responses.put(resp)
+                resp = wire.read_message(self.proc.stdout, self._read_framing)
+            except ValueError as e:
+                logging.error("[MCP client] undecodable message from server: %s", e)
+                continue
+            if resp is None:
+                break
+            if resp.get("ok") and "framing" in resp:
+                # negotiate reply: the server switches framing right after writing it
+                self._read_framing = resp["framing"]
+            self._dispatch(resp)
+        self._fail_pending(MCPClientError("server closed the connection"))
+
+    def _dispatch(self, resp):
+        req_id = resp.get("id")
+        with self._pending_lock:
+            sink = self._pending.get(req_id)
+            if sink is not None and (not isinstance(sink, _Stream) or _is_last(resp)):
+                del self._pending[req_id]
+        if sink is None:
+            # reply to a request that already timed out (or carries no id): drop it
+            # instead of handing it to whoever is waiting next
+            logging.warning("[MCP client] discarding reply for unknown request id %r", req_id)
+        elif isinstance(sink, _Stream):
+            sink.put(resp)
+        else:
+            sink.set_result(resp)
+
+    def _fail_pending(self, exc):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for sink in pending.values():
+            if isinstance(sink, _Stream):
+                sink.put(exc)
+            elif not sink.done():
+                sink.set_exception(exc)
 
     def _stderr_loop(self):
         for line in self.proc.stderr:
-            line = line.rstrip('\n')
+            line = line.decode("utf-8", "replace").rstrip("\n")
             if line:
                 logging.error("[MCP server stderr] %s", line)
 
+    def _send(self, payload, sink):
+        if self._closed:
+            raise MCPClientError("client is closed")
+        req_id = next(self._ids)
+        with self._pending_lock:
+            self._pending[req_id] = sink
+        try:
+            self._write(dict(payload, id=req_id))
+        except MCPClientError:
+            self._forget(req_id)
+            raise
+        return req_id
+
+    def _write(self, payload):
+        """Write one message; stream credits and cancels go out this way, without an id or reply."""
+        try:
+            with self._write_lock:
+                self.proc.stdin.write(wire.encode(payload, self._write_framing))
+                self.proc.stdin.flush()
+        except Exception as e:
+            raise MCPClientError("failed write to server: " + str(e))
+
+    def _cancel_stream(self, req_id):
+        # chunks already on the pipe and the server's end marker are dropped quietly
+        with self._pending_lock:
+            if req_id not in self._pending:
+                return
+            self._pending[req_id] = _Stream(_drop)
+        try:
+            self._write(_cancel(req_id))
+        except MCPClientError:
+            self._forget(req_id)
+
+    def submit(self, payload):
+        """Send a request without waiting; returns a Future resolved with the reply."""
+        fut = Future()
+        fut.request_id = self._send(payload, fut)
+        return fut
+
+    def _forget(self, req_id):
+        with self._pending_lock:
+            self._pending.pop(req_id, None)
+
     def request(self, payload, timeout=5):
-        with self._lock:
+        with telemetry.span("mcp.request", {"mcp.cmd": str(payload.get("cmd"))}) as span:
+            started = time.perf_counter()
+            fut = self.submit(_traced(payload))
             try:
-                self.proc.stdin.write(json.dumps(payload) + '\n')
-                self.proc.stdin.flush()
-            except Exception as e:
-                raise MCPClientError('failed write to server: ' + str(e))
+                resp = fut.result(timeout=timeout)
+            except FutureTimeout:
+                self._forget(fut.request_id)
+                raise MCPClientError("timeout waiting for server response")
+            _record_reply(span, payload.get("cmd"), started, resp)
+            return resp
+
+    async def arequest(self, payload, timeout=5):
+        """Awaitable request for asyncio callers; bridges the reply future without a thread hop."""
+        with telemetry.span("mcp.request", {"mcp.cmd": str(payload.get("cmd"))}) as span:
+            started = time.perf_counter()
+            fut = self.submit(_traced(payload))
             try:
-                resp = self._responses.get(timeout=timeout)
-            except queue.Empty:
-                raise MCPClientError('timeout waiting for server response')
+                resp = await asyncio.wait_for(asyncio.wrap_future(fut), timeout)
+            except asyncio.TimeoutError:
+                self._forget(fut.request_id)
+                raise MCPClientError("timeout waiting for server response")
+            _record_reply(span, payload.get("cmd"), started, resp)
             return resp
 
+    def stream(self, payload, timeout=5, window=STREAM_WINDOW):
+        """Send a streaming request and yield each chunk message ({'data': [...], ...}) as it
+        arrives; `timeout` applies per message. At most `window` chunks are sent ahead of
+        the caller: the server waits for a credit for every chunk taken, so a slow caller
+        slows the server down instead of buffering the stream here. Closing the generator
+        early cancels the stream on the server."""
+        window = max(1, int(window))
+        # window chunks plus the end marker (or an error) is all the server can send unasked
+        replies = queue.Queue(maxsize=window + 1)
+        started = time.perf_counter()
+        req_id = self._send(
+            _traced(dict(payload, stream=True, window=window)), _Stream(replies.put_nowait)
+        )
+        ended = False
+        try:
+            while True:
+                try:
+                    raw = replies.get(timeout=timeout)
+                except queue.Empty:
+                    raise MCPClientError("timeout waiting for server response")
+                ended = not isinstance(raw, dict) or _is_last(raw)
+                msg = _stream_message(raw)
+                if msg is None:
+                    _record_reply(None, payload.get("cmd"), started, raw)
+                    return
+                yield msg
+                self._write(_credit(req_id))
+        finally:
+            if not ended:
+                self._cancel_stream(req_id)
+
+    async def astream(self, payload, timeout=5, window=STREAM_WINDOW):
+        """Async variant of stream(); chunks are handed to the caller's loop without a thread hop."""
+        loop = asyncio.get_running_loop()
+        window = max(1, int(window))
+        replies = asyncio.Queue(maxsize=window + 1)
+        sink = _Stream(lambda msg: loop.call_soon_threadsafe(replies.put_nowait, msg))
+        started = time.perf_counter()
+        req_id = self._send(_traced(dict(payload, stream=True, window=window)), sink)
+        ended = False
+        try:
+            while True:
+                try:
+                    raw = await asyncio.wait_for(replies.get(), timeout)
+                except asyncio.TimeoutError:
+                    raise MCPClientError("timeout waiting for server response")
+                ended = not isinstance(raw, dict) or _is_last(raw)
+                msg = _stream_message(raw)
+                if msg is None:
+                    _record_reply(None, payload.get("cmd"), started, raw)
+                    return
+                yield msg
+                self._write(_credit(req_id))
+        finally:
+            if not ended:
+                self._cancel_stream(req_id)
+
     def close(self):
+        self._closed = True
         try:
             self.proc.terminate()
-        except:
+        except Exception:
             pass
+        self._fail_pending(MCPClientError("client closed"))
+
 
-if __name__ == '__main__':
+if __name__ == "__main__":
     c = MCPClient()
-    r = c.request({'cmd':'get_consumer_summary'})
-    print('got', len(r.get('data',[])))
+    r = c.request({"cmd": "get_consumer_summary"})
+    print("got", len(r.get("data", [])))
     c.close()
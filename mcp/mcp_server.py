@@ -1,59 +1,680 @@
-# MCP server (stdio JSON-lines)
-import sys, json, sqlite3, os, traceback
+# MCP server (stdio; JSON-lines by default, msgpack framing on request - see mcp/wire.py)
+import asyncio
+import os
+import pathlib
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
-DB = os.path.join(os.path.dirname(__file__), "../data/mock_data.db")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents.scenarios import SCENARIOS, USAGE_THRESHOLD_KWH
+from mcp import wire
+from observability import telemetry
 
-def handle_request(req):
-    cmd = req.get('cmd')
-    if cmd == 'get_consumer_summary':
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-        cur.execute("""
-        SELECT consumer_id, AVG(daily_kwh) as avg_kwh, MAX(uses_efficient_equipment) as efficient, MAX(produces_solar) as solar
-        FROM consumption
+DB = os.getenv("MCP_DB_PATH") or os.path.join(os.path.dirname(__file__), "../data/mock_data.db")
+MAX_WORKERS = int(os.getenv("MCP_SERVER_WORKERS", "8"))
+MAX_LINE = 64 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 500
+_WRITE_LOCK = threading.Lock()
+_FRAMING = "json"
+DEFAULT_BIN_WIDTH = 1.0
+USAGE_COLUMNS = (
+    "consumer_id",
+    "avg_kwh",
+    "total_kwh",
+    "days",
+    "uses_efficient_equipment",
+    "produces_solar",
+)
+DEFAULT_WINDOW_DAYS = 30
+HISTOGRAM_COLUMNS = ("lower_kwh", "upper_kwh", "consumers")
+SUMMARY_COLUMNS = ("consumer_id", "avg_kwh", "uses_efficient_equipment", "produces_solar")
+RECORD_COLUMNS = ("consumer_id", "date", "daily_kwh", "uses_efficient_equipment", "produces_solar")
+
+# SQL is kept as module constants: sqlite3 caches prepared statements per connection
+# keyed by the SQL text, so reusing the same string skips re-parsing on every call.
+# consumer_rollup is maintained by triggers on consumption (see scripts/generate_mock_db.py),
+# so the summary reads one row per consumer instead of aggregating every reading.
+# Paging is keyset-based on the rollup primary key: after '' / LIMIT -1 means "everything".
+SQL_CONSUMER_SUMMARY = """
+        SELECT consumer_id, kwh_sum / day_count as avg_kwh, efficient_days > 0 as efficient, solar_days > 0 as solar
+        FROM consumer_rollup
+        WHERE consumer_id > ?
+        ORDER BY consumer_id
+        LIMIT ?
+        """
+SQL_CONSUMER_COUNT = "SELECT COUNT(*) FROM consumer_rollup"
+# Sharded variants ({'shard_index': i, 'shard_count': n}): only consumers whose
+# shard_of(consumer_id, n) == i, so n workers can each take one slice of the neighbourhood
+SQL_CONSUMER_SUMMARY_SHARD = """
+        SELECT consumer_id, kwh_sum / day_count as avg_kwh, efficient_days > 0 as efficient, solar_days > 0 as solar
+        FROM consumer_rollup
+        WHERE consumer_id > ? AND shard_of(consumer_id, ?) = ?
+        ORDER BY consumer_id
+        LIMIT ?
+        """
+SQL_CONSUMER_COUNT_SHARD = "SELECT COUNT(*) FROM consumer_rollup WHERE shard_of(consumer_id, ?) = ?"
+# Aggregations pushed into SQL so callers get answers without pulling every consumer.
+# The CASE mirrors agents.discounts.classify on the same rounded avg_kwh the summary
+# returns; the threshold is a parameter. `? <= 1 OR shard_of(...)` keeps one statement
+# for both the sharded and the whole-neighbourhood case.
+SQL_SCENARIO_CASE = """CASE
+            WHEN round(kwh_sum / day_count, 2) >= ? THEN 'high_usage'
+            WHEN efficient_days > 0 AND solar_days > 0 THEN '10_percent'
+            WHEN efficient_days > 0 THEN '5_percent_efficient'
+            WHEN solar_days > 0 THEN '5_percent_solar'
+            ELSE 'no_discount_low_usage'
+        END"""
+SQL_SCENARIO_COUNTS = f"""
+        SELECT {SQL_SCENARIO_CASE} as scenario, COUNT(*)
+        FROM consumer_rollup
+        WHERE ? <= 1 OR shard_of(consumer_id, ?) = ?
+        GROUP BY scenario
+        """
+SQL_CONSUMERS_BY_SCENARIO = f"""
+        SELECT consumer_id, kwh_sum / day_count as avg_kwh, efficient_days > 0 as efficient, solar_days > 0 as solar
+        FROM consumer_rollup
+        WHERE consumer_id > ? AND {SQL_SCENARIO_CASE} = ? AND (? <= 1 OR shard_of(consumer_id, ?) = ?)
+        ORDER BY consumer_id
+        LIMIT ?
+        """
+# bin is NULL for the overflow bucket (avg_kwh at or above max_kwh)
+SQL_USAGE_HISTOGRAM = """
+        SELECT CASE WHEN round(kwh_sum / day_count, 2) >= ? THEN NULL
+                    ELSE CAST(round(kwh_sum / day_count, 2) / ? AS INTEGER) END as bin, COUNT(*)
+        FROM consumer_rollup
+        WHERE ? <= 1 OR shard_of(consumer_id, ?) = ?
+        GROUP BY bin
+        ORDER BY bin
+        """
+# Windowed usage, served from the rollups maintained by scripts/generate_mock_db.py:
+# consumer_monthly for calendar months and consumer_window for the precomputed rolling
+# windows. A window that is not precomputed (or is stale) is read from the window's own
+# days via idx_consumption_date, never by scanning a consumer's whole history.
+SQL_LATEST_DATE = "SELECT MAX(date) FROM consumption"
+SQL_WINDOW_STATE = "SELECT as_of FROM window_state WHERE window_days = ?"
+SQL_WINDOW_USAGE = """
+        SELECT consumer_id, kwh_sum / day_count, kwh_sum, day_count, efficient_days > 0, solar_days > 0
+        FROM consumer_window
+        WHERE window_days = ? AND consumer_id > ? AND (? <= 1 OR shard_of(consumer_id, ?) = ?)
+        ORDER BY consumer_id
+        LIMIT ?
+        """
+SQL_WINDOW_COUNT = """SELECT COUNT(*) FROM consumer_window
+                      WHERE window_days = ? AND (? <= 1 OR shard_of(consumer_id, ?) = ?)"""
+SQL_WINDOW_USAGE_LIVE = """
+        SELECT consumer_id, SUM(daily_kwh) / COUNT(*), SUM(daily_kwh), COUNT(*),
+               MAX(uses_efficient_equipment != 0), MAX(produces_solar != 0)
+        FROM consumption INDEXED BY idx_consumption_date
+        WHERE date > date(?, ?) AND date <= ? AND consumer_id > ? AND (? <= 1 OR shard_of(consumer_id, ?) = ?)
         GROUP BY consumer_id
-        """)
-        rows = cur.fetchall()
-        conn.close()
-        result = []
-        for r in rows:
-            result.append({
-                'consumer_id': r[0],
-                'avg_kwh': round(r[1],2),
-                'uses_efficient_equipment': bool(r[2]),
-                'produces_solar': bool(r[3])
-            })
-        return {'ok': True, 'data': result}
-    elif cmd == 'get_recent_records':
-        n = req.get('n', 100)
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-        cur.execute("""SELECT consumer_id, date, daily_kwh, uses_efficient_equipment, produces_solar
-                       FROM consumption ORDER BY date DESC LIMIT ?""", (n,))
-        rows = cur.fetchall()
-        conn.close()
-        data = [{'consumer_id':r[0], 'date':r[1], 'daily_kwh':r[2], 'uses_efficient_equipment':bool(r[3]), 'produces_solar':bool(r[4])} for r in rows]
-        return {'ok': True, 'data': data}
+        ORDER BY consumer_id
+        LIMIT ?
+        """
+SQL_WINDOW_COUNT_LIVE = """SELECT COUNT(DISTINCT consumer_id) FROM consumption INDEXED BY idx_consumption_date
+                           WHERE date > date(?, ?) AND date <= ? AND (? <= 1 OR shard_of(consumer_id, ?) = ?)"""
+SQL_MONTHLY_USAGE = """
+        SELECT consumer_id, kwh_sum / day_count, kwh_sum, day_count, efficient_days > 0, solar_days > 0
+        FROM consumer_monthly
+        WHERE month = ? AND consumer_id > ? AND (? <= 1 OR shard_of(consumer_id, ?) = ?)
+        ORDER BY consumer_id
+        LIMIT ?
+        """
+SQL_MONTHLY_COUNT = """SELECT COUNT(*) FROM consumer_monthly
+                       WHERE month = ? AND (? <= 1 OR shard_of(consumer_id, ?) = ?)"""
+SQL_RECENT_RECORDS = """SELECT consumer_id, date, daily_kwh, uses_efficient_equipment, produces_solar
+                       FROM consumption ORDER BY date DESC LIMIT ?"""
+
+CACHE_SIZE_KB = int(os.getenv("MCP_SQLITE_CACHE_KB", "65536"))
+MMAP_SIZE = int(os.getenv("MCP_SQLITE_MMAP_BYTES", str(1024 * 1024 * 1024)))
+_LOCAL = threading.local()
+_CONNECTIONS = []
+_CONN_LOCK = threading.Lock()
+# open streams that asked for flow control, by request id (see StreamCredits)
+_STREAMS = {}
+_STREAMS_LOCK = threading.Lock()
+
+
+def shard_of(consumer_id, shard_count):
+    """Stable hash partition of a consumer id (crc32, so it is the same in every process)."""
+    return zlib.crc32(consumer_id.encode("utf-8")) % shard_count
+
+
+def get_connection():
+    """Long-lived read-only connection for the calling worker thread."""
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None:
+        uri = pathlib.Path(os.path.abspath(DB)).as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA query_only = 1")
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.create_function("shard_of", 2, shard_of, deterministic=True)
+        _LOCAL.conn = conn
+        with _CONN_LOCK:
+            _CONNECTIONS.append(conn)
+    return conn
+
+
+def close_connections():
+    with _CONN_LOCK:
+        conns = list(_CONNECTIONS)
+        _CONNECTIONS.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def _add_sql_time(started):
+    # per-request SQL time, read back by process_request for the reply's timings
+    _LOCAL.sql_ms = getattr(_LOCAL, "sql_ms", 0.0) + (time.perf_counter() - started) * 1000.0
+
+
+def _summary_values(r):
+    return (r[0], round(r[1], 2), bool(r[2]), bool(r[3]))
+
+
+def _shard(req):
+    """(shard_index, shard_count) from a request, or None when it is not sharded."""
+    count = int(req.get("shard_count") or 1)
+    if count <= 1:
+        return None
+    index = int(req.get("shard_index", 0))
+    if not 0 <= index < count:
+        raise ValueError("shard_index must be in [0, shard_count)")
+    return index, count
+
+
+def _summary_cursor(req):
+    after = req.get("after_consumer_id") or ""
+    limit = -1 if req.get("limit") is None else int(req.get("limit"))
+    shard = _shard(req)
+    if shard:
+        return get_connection().execute(
+            SQL_CONSUMER_SUMMARY_SHARD, (after, shard[1], shard[0], limit)
+        )
+    return get_connection().execute(SQL_CONSUMER_SUMMARY, (after, limit))
+
+
+def _consumer_count(req):
+    shard = _shard(req)
+    if shard:
+        return (
+            get_connection().execute(SQL_CONSUMER_COUNT_SHARD, (shard[1], shard[0])).fetchone()[0]
+        )
+    return get_connection().execute(SQL_CONSUMER_COUNT).fetchone()[0]
+
+
+def _shard_args(req):
+    # (shard_count, shard_count, shard_index) for the `? <= 1 OR shard_of(consumer_id, ?) = ?` clause
+    shard = _shard(req) or (0, 1)
+    return (shard[1], shard[1], shard[0])
+
+
+def _threshold(req):
+    threshold = req.get("usage_threshold")
+    return USAGE_THRESHOLD_KWH if threshold is None else float(threshold)
+
+
+def _scenario(req):
+    scenario = req.get("scenario")
+    if scenario not in SCENARIOS:
+        raise ValueError(f"scenario must be one of {', '.join(SCENARIOS)}")
+    return scenario
+
+
+def scenario_counts(req):
+    """Scenario name -> consumer count, every scenario present (zeros included)."""
+    started = time.perf_counter()
+    rows = (
+        get_connection()
+        .execute(SQL_SCENARIO_COUNTS, (_threshold(req),) + _shard_args(req))
+        .fetchall()
+    )
+    _add_sql_time(started)
+    counts = dict.fromkeys(SCENARIOS, 0)
+    counts.update(rows)
+    return counts
+
+
+def _by_scenario_cursor(req):
+    after = req.get("after_consumer_id") or ""
+    limit = -1 if req.get("limit") is None else int(req.get("limit"))
+    params = (after, _threshold(req), _scenario(req)) + _shard_args(req) + (limit,)
+    return get_connection().execute(SQL_CONSUMERS_BY_SCENARIO, params)
+
+
+def usage_histogram(req):
+    """Consumers per avg_kwh bucket of `bin_width`. With `max_kwh`, everything at or above
+    it goes to a last [max_kwh, None) bucket, and the bucket below ends at max_kwh.
+    Empty buckets are left out."""
+    width = float(req.get("bin_width") or DEFAULT_BIN_WIDTH)
+    if width <= 0:
+        raise ValueError("bin_width must be positive")
+    cap = req.get("max_kwh")
+    cap = float("inf") if cap is None else float(cap)
+    started = time.perf_counter()
+    rows = get_connection().execute(SQL_USAGE_HISTOGRAM, (cap, width) + _shard_args(req)).fetchall()
+    _add_sql_time(started)
+    buckets = [
+        (round(b * width, 6), round(min((b + 1) * width, cap), 6), n)
+        for b, n in rows
+        if b is not None
+    ]
+    overflow = sum(n for b, n in rows if b is None)
+    if overflow:
+        buckets.append((cap, None, overflow))
+    return buckets
+
+
+def _usage_values(r):
+    return (r[0], round(r[1], 2), round(r[2], 2), r[3], bool(r[4]), bool(r[5]))
+
+
+def _usage_query(req):
+    """(sql, params, count sql, count params, meta) for a get_window_usage or
+    get_monthly_usage request; params end with the page limit."""
+    conn = get_connection()
+    after = req.get("after_consumer_id") or ""
+    limit = -1 if req.get("limit") is None else int(req.get("limit"))
+    shard = _shard_args(req)
+    if req.get("cmd") == "get_monthly_usage":
+        month = req.get("month") or (conn.execute(SQL_LATEST_DATE).fetchone()[0] or "")[:7]
+        if month and not (len(month) == 7 and month[4] == "-"):
+            raise ValueError("month must look like YYYY-MM")
+        return (
+            SQL_MONTHLY_USAGE,
+            (month, after) + shard + (limit,),
+            SQL_MONTHLY_COUNT,
+            (month,) + shard,
+            {"month": month},
+        )
+    days = int(req.get("days") or DEFAULT_WINDOW_DAYS)
+    if days <= 0:
+        raise ValueError("days must be positive")
+    as_of = conn.execute(SQL_LATEST_DATE).fetchone()[0] or ""
+    state = conn.execute(SQL_WINDOW_STATE, (days,)).fetchone()
+    meta = {"days": days, "as_of": as_of}
+    if state and state[0] == as_of:
+        return (
+            SQL_WINDOW_USAGE,
+            (days, after) + shard + (limit,),
+            SQL_WINDOW_COUNT,
+            (days,) + shard,
+            dict(meta, source="rollup"),
+        )
+    span = (as_of, f"-{days} days", as_of)
+    return (
+        SQL_WINDOW_USAGE_LIVE,
+        span + (after,) + shard + (limit,),
+        SQL_WINDOW_COUNT_LIVE,
+        span + shard,
+        dict(meta, source="readings"),
+    )
+
+
+def _page(rows, req):
+    # cursor for the next page: only set when a limited page came back full
+    limit = req.get("limit")
+    return rows[-1][0] if limit and rows and len(rows) == int(limit) else None
+
+
+def handle_request(req):
+    cmd = req.get("cmd")
+    if cmd == "get_consumer_summary":
+        started = time.perf_counter()
+        raw = _summary_cursor(req).fetchall()
+        _add_sql_time(started)
+        rows = [_summary_values(r) for r in raw]
+        data = wire.shape_rows(rows, SUMMARY_COLUMNS, req.get("layout", "rows"))
+        return {"ok": True, "data": data, "next_after": _page(rows, req)}
+    elif cmd == "get_scenario_counts":
+        counts = scenario_counts(req)
+        return {"ok": True, "data": counts, "total": sum(counts.values())}
+    elif cmd == "get_consumers_by_scenario":
+        started = time.perf_counter()
+        raw = _by_scenario_cursor(req).fetchall()
+        _add_sql_time(started)
+        rows = [_summary_values(r) for r in raw]
+        data = wire.shape_rows(rows, SUMMARY_COLUMNS, req.get("layout", "rows"))
+        return {"ok": True, "data": data, "next_after": _page(rows, req)}
+    elif cmd == "get_usage_histogram":
+        rows = usage_histogram(req)
+        return {
+            "ok": True,
+            "data": wire.shape_rows(rows, HISTOGRAM_COLUMNS, req.get("layout", "rows")),
+            "bin_width": float(req.get("bin_width") or DEFAULT_BIN_WIDTH),
+        }
+    elif cmd in ("get_window_usage", "get_monthly_usage"):
+        started = time.perf_counter()
+        sql, params, _, _, meta = _usage_query(req)
+        rows = [_usage_values(r) for r in get_connection().execute(sql, params).fetchall()]
+        _add_sql_time(started)
+        data = wire.shape_rows(rows, USAGE_COLUMNS, req.get("layout", "rows"))
+        return dict(meta, ok=True, data=data, next_after=_page(rows, req))
+    elif cmd == "get_recent_records":
+        n = req.get("n", 100)
+        started = time.perf_counter()
+        rows = get_connection().execute(SQL_RECENT_RECORDS, (n,)).fetchall()
+        _add_sql_time(started)
+        rows = [(r[0], r[1], r[2], bool(r[3]), bool(r[4])) for r in rows]
+        return {
+            "ok": True,
+            "data": wire.shape_rows(rows, RECORD_COLUMNS, req.get("layout", "rows")),
+        }
     else:
-        return {'ok': False, 'error': 'unknown_cmd'}
+        return {"ok": False, "error": "unknown_cmd"}
 
-def main():
+
+def stream_consumer_summary(req):
+    started = time.perf_counter()
+    total = _consumer_count(req)
+    cur = _summary_cursor(req)
+    _add_sql_time(started)
+    return _stream_rows(req, cur, total)
+
+
+def stream_usage(req):
+    started = time.perf_counter()
+    sql, params, count_sql, count_params, meta = _usage_query(req)
+    total = get_connection().execute(count_sql, count_params).fetchone()[0]
+    cur = get_connection().execute(sql, params)
+    _add_sql_time(started)
+    return _stream_rows(req, cur, total, USAGE_COLUMNS, _usage_values, meta)
+
+
+def stream_consumers_by_scenario(req):
+    # total comes from the same GROUP BY as get_scenario_counts, not a second filtered scan
+    total = scenario_counts(req)[_scenario(req)]
+    started = time.perf_counter()
+    cur = _by_scenario_cursor(req)
+    _add_sql_time(started)
+    return _stream_rows(req, cur, total)
+
+
+class StreamCredits:
+    """Receive window of one stream: how many more chunks the client accepts. A stream
+    request with {'window': n} may send n chunks; every {'cmd': 'stream_credit'} from the
+    client allows more, and {'cmd': 'stream_cancel'} stops the stream."""
+
+    def __init__(self, window):
+        self.credits = window
+        self.cancelled = False
+        self._cond = threading.Condition()
+
+    def grant(self, n=1):
+        with self._cond:
+            self.credits += n
+            self._cond.notify()
+
+    def cancel(self):
+        with self._cond:
+            self.cancelled = True
+            self._cond.notify()
+
+    def take(self):
+        """Wait for a credit; False once the stream is cancelled."""
+        with self._cond:
+            while self.credits <= 0 and not self.cancelled:
+                self._cond.wait()
+            if self.cancelled:
+                return False
+            self.credits -= 1
+            return True
+
+
+def open_stream(req):
+    """Register a flow-controlled stream before its worker starts, so a credit or cancel
+    can never arrive for an unknown stream."""
+    window = int(req.get("window") or 0)
+    if window > 0 and "id" in req:
+        with _STREAMS_LOCK:
+            _STREAMS[req["id"]] = StreamCredits(window)
+
+
+def stream_control(req):
+    """Apply a stream_credit / stream_cancel message (inline, never answered)."""
+    with _STREAMS_LOCK:
+        credits = _STREAMS.get(req.get("stream_id"))
+    if credits is None:
+        return  # the stream already ended
+    if req.get("cmd") == "stream_cancel":
+        credits.cancel()
+    else:
+        credits.grant(int(req.get("credits") or 1))
+
+
+def cancel_streams():
+    with _STREAMS_LOCK:
+        streams = list(_STREAMS.values())
+    for credits in streams:
+        credits.cancel()
+
+
+def _stream_rows(req, cur, total, columns=SUMMARY_COLUMNS, values=_summary_values, meta=None):
+    chunk_size = int(req.get("chunk_size") or DEFAULT_CHUNK_SIZE)
+    layout = req.get("layout", "rows")
+    while True:
+        started = time.perf_counter()
+        rows = cur.fetchmany(chunk_size)
+        _add_sql_time(started)
+        if not rows:
+            break
+        msg = {"data": wire.shape_rows([values(r) for r in rows], columns, layout), "total": total}
+        if meta:
+            msg.update(meta)
+        yield msg
+
+
+# commands that support {'stream': true}: the reply is a run of {'ok', 'data'} chunk
+# messages followed by {'ok': true, 'end': true, 'count': n}, all carrying the request id
+STREAM_HANDLERS = {
+    "get_consumer_summary": stream_consumer_summary,
+    "get_consumers_by_scenario": stream_consumers_by_scenario,
+    "get_window_usage": stream_usage,
+    "get_monthly_usage": stream_usage,
+}
+
+
+def iter_responses(req):
+    if not req.get("stream"):
+        yield handle_request(req)
+        return
+    handler = STREAM_HANDLERS.get(req.get("cmd"))
+    if handler is None:
+        yield {"ok": False, "error": "stream_not_supported", "end": True}
+        return
+    with _STREAMS_LOCK:
+        credits = _STREAMS.get(req.get("id"))
+    count = 0
+    for msg in handler(req):
+        # a slow client holds this worker here instead of having the stream pile up in its memory
+        if credits is not None and not credits.take():
+            yield {"ok": True, "end": True, "count": count, "cancelled": True}
+            return
+        count += wire.row_count(msg["data"])
+        msg["ok"] = True
+        yield msg
+    yield {"ok": True, "end": True, "count": count}
+
+
+def process_request(req, received=None):
+    started = time.perf_counter()
+    _LOCAL.sql_ms = 0.0
+    is_dict = isinstance(req, dict)
+    cmd = str(req.get("cmd")) if is_dict else None
+    want_timing = is_dict and req.get("timing")
+    with telemetry.span(
+        "mcp.server.handle",
+        {"mcp.cmd": cmd},
+        context=telemetry.extract(req.get("trace") if is_dict else None),
+    ) as span:
+        try:
+            for resp in iter_responses(req):
+                if want_timing and (not req.get("stream") or resp.get("end")):
+                    resp["timing"] = _timings(received, started)
+                _reply(req, resp, cmd)
+        except Exception as e:
+            span.record_exception(e)
+            resp = {"ok": False, "error": str(e), "trace": traceback.format_exc()}
+            if is_dict and req.get("stream"):
+                resp["end"] = True
+            if want_timing:
+                resp["timing"] = _timings(received, started)
+            _reply(req, resp, cmd)
+        finally:
+            if is_dict and req.get("stream"):
+                with _STREAMS_LOCK:
+                    _STREAMS.pop(req.get("id"), None)
+        timings = _timings(received, started)
+        span.set_attributes({f"mcp.{key}": value for key, value in timings.items()})
+    attrs = {"mcp.cmd": cmd}
+    telemetry.histogram("mcp.server.queue").record(timings["queue_ms"], attrs)
+    telemetry.histogram("mcp.server.handle").record(timings["handle_ms"], attrs)
+    telemetry.histogram("mcp.server.sql").record(timings["sql_ms"], attrs)
+
+
+def _timings(received, started):
+    """Milliseconds spent waiting for a worker, handling so far, and in SQLite."""
+    now = time.perf_counter()
+    return {
+        "queue_ms": round((started - received) * 1000.0, 3) if received else 0.0,
+        "handle_ms": round((now - started) * 1000.0, 3),
+        "sql_ms": round(getattr(_LOCAL, "sql_ms", 0.0), 3),
+    }
+
+
+def _reply(req, resp, cmd=None):
+    # echo the request id so the client can route replies to the right caller
+    if isinstance(req, dict) and "id" in req:
+        resp["id"] = req["id"]
+    write_response(resp, cmd)
+
+
+def write_response(resp, cmd=None):
+    # replies are written from worker threads; keep each frame whole
+    with _WRITE_LOCK:
+        started = time.perf_counter()
+        encoded = wire.encode(resp, _FRAMING)
+        encoded_at = time.perf_counter()
+        sys.stdout.buffer.write(encoded)
+        sys.stdout.buffer.flush()
+    if telemetry.enabled():
+        attrs = {"mcp.cmd": str(cmd), "mcp.framing": _FRAMING}
+        telemetry.histogram("mcp.server.encode").record((encoded_at - started) * 1000.0, attrs)
+        telemetry.histogram("mcp.server.write").record(
+            (time.perf_counter() - encoded_at) * 1000.0, attrs
+        )
+
+
+def negotiate(req):
+    """Switch framing for the rest of the connection. The reply still goes out in the
+    old framing; everything after it (both directions) uses the new one."""
+    global _FRAMING
+    framing = req.get("framing", "json")
+    if framing not in wire.available_framings():
+        _reply(
+            req,
+            {"ok": False, "error": "unsupported_framing", "framings": wire.available_framings()},
+        )
+        return
+    with _WRITE_LOCK:
+        resp = {"ok": True, "framing": framing, "framings": wire.available_framings()}
+        if "id" in req:
+            resp["id"] = req["id"]
+        sys.stdout.buffer.write(wire.encode(resp, _FRAMING))
+        sys.stdout.buffer.flush()
+        _FRAMING = framing
+
+
+class _ThreadedStdin:
+    """readline/readexactly over a reader thread, for platforms where asyncio can't
+    attach to stdin (e.g. Windows consoles)."""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._fp = sys.stdin.buffer
+
+    def readline(self):
+        return self._loop.run_in_executor(None, self._fp.readline)
+
+    def readexactly(self, n):
+        return self._loop.run_in_executor(None, self._fp.read, n)
+
+
+async def _open_stdin():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_LINE)
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        return reader
+    except (NotImplementedError, OSError, ValueError):
+        return _ThreadedStdin(loop)
+
+
+async def serve():
+    loop = asyncio.get_running_loop()
+    stdin = await _open_stdin()
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mcp-worker")
+    # stop reading new requests while every worker is busy so the pipe applies backpressure
+    slots = asyncio.Semaphore(MAX_WORKERS * 2)
+    inflight = set()
     try:
         while True:
-            line = sys.stdin.readline()
-            if not line:
-                break
-            line = line.strip()
-            if not line: continue
             try:
-                req = json.loads(line)
-                resp = handle_request(req)
-            except Exception as e:
-                resp = {'ok': False, 'error': str(e), 'trace': traceback.format_exc()}
-            sys.stdout.write(json.dumps(resp) + '\n')
-            sys.stdout.flush()
+                req = await wire.aread_message(stdin, _FRAMING)
+            except ValueError as e:
+                write_response({"ok": False, "error": f"invalid_json: {e}"})
+                continue
+            if req is None:
+                # the client is gone: release streams waiting for credits it will never send
+                cancel_streams()
+                break
+            if isinstance(req, dict) and req.get("cmd") == "negotiate":
+                # handled inline so no reply is in flight while the framing changes
+                if inflight:
+                    await asyncio.wait(inflight)
+                negotiate(req)
+                continue
+            if isinstance(req, dict) and req.get("cmd") in ("stream_credit", "stream_cancel"):
+                # inline too: the stream waiting for it may hold a worker (and a slot)
+                stream_control(req)
+                continue
+            if isinstance(req, dict) and req.get("stream"):
+                open_stream(req)
+            await slots.acquire()
+            task = loop.run_in_executor(executor, process_request, req, time.perf_counter())
+            inflight.add(task)
+            task.add_done_callback(lambda t: (inflight.discard(t), slots.release()))
+        if inflight:
+            await asyncio.wait(inflight)
+    finally:
+        executor.shutdown(wait=False)
+        close_connections()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    # stdout is the protocol pipe and stderr goes to the client's error log: never export to the console
+    if telemetry.setup("mcp-server", exporter="file" if telemetry.EXPORTER == "console" else None):
+        # the client stops us with SIGTERM; exit through the normal path so spans get flushed
+        signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        asyncio.run(serve())
     except KeyboardInterrupt:
         pass
 
-if __name__ == '__main__':
+
+if __name__ == "__main__":
     main()
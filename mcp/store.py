@@ -1,15 +1,532 @@
-import uuid, time
+"""In-process MCP context store.
+
+Contexts are bounded by count (MCP_STORE_MAX_ENTRIES), age (MCP_STORE_TTL seconds since
+created_at, 0 = no expiry) and an approximate memory budget (MCP_STORE_MAX_BYTES, pickled
+size). The least recently used context, across all stripes, is evicted first.
+
+neighborhood_state, user_profiles and tool_manifest are stored as content-addressed
+snapshots: a private copy is taken once per distinct value and shared by every context
+that carries the same content, so contexts that differ only in task_state cost one
+task_state each. Snapshots are shared between contexts, so treat what get_mcp returns as
+read-only; update_mcp replaces a context (copy-on-write) instead of mutating it.
+
+Entries live in MCP_STORE_STRIPES independently locked LRU stripes keyed by mcp_id, so
+concurrent get_mcp calls only contend when they land on the same stripe. Every access
+stamps the entry from one global counter. Eviction compares the stripes' LRU heads by
+that stamp, so it follows global recency.
+
+MCP_STORE_BACKEND=sqlite switches to SharedContextStore, a file (MCP_STORE_PATH) that
+every process on the machine sees: sharded workers or a restarted agent can read
+contexts created elsewhere.
+"""
+
+import hashlib
+import itertools
+import os
+import pickle
+import sqlite3
 import threading
-MCP_STORE = {}
-_LOCK = threading.Lock()
+import time
+import uuid
+from collections import OrderedDict
+
+MAX_ENTRIES = int(os.getenv("MCP_STORE_MAX_ENTRIES", "10000"))
+TTL = float(os.getenv("MCP_STORE_TTL", "3600"))
+MAX_BYTES = int(os.getenv("MCP_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+STRIPES = int(os.getenv("MCP_STORE_STRIPES", "16"))
+SHARED_FIELDS = ("neighborhood_state", "user_profiles", "tool_manifest")
+BACKEND = os.getenv("MCP_STORE_BACKEND", "memory").lower()
+STORE_PATH = os.getenv("MCP_STORE_PATH") or os.path.join(
+    os.path.dirname(__file__), "../data/mcp_store.db"
+)
+MMAP_SIZE = int(os.getenv("MCP_STORE_MMAP_BYTES", str(1024 * 1024 * 1024)))
+DECODED_SNAPSHOTS = int(os.getenv("MCP_STORE_DECODED_SNAPSHOTS", "64"))
+
+
+class _Snapshot:
+    __slots__ = ("key", "value", "size", "refs")
+
+    def __init__(self, key, value, size):
+        self.key, self.value, self.size, self.refs = key, value, size, 0
+
+
+class _Entry:
+    __slots__ = ("context", "snaps", "size", "used")
+
+    def __init__(self, context, snaps, size):
+        self.context, self.snaps, self.size, self.used = context, snaps, size, 0
+
+
+class _Stripe:
+    __slots__ = ("lock", "entries")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+
+class ContextStore:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL, max_bytes=MAX_BYTES, stripes=STRIPES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._stripes = [_Stripe() for _ in range(max(1, stripes))]
+        self._snapshots = {}
+        # guards the snapshot table and the global counters; never held while taking a stripe lock
+        self._lock = threading.Lock()
+        self._count = 0
+        self._bytes = 0
+        self.evictions = 0
+        # access stamps; next() on itertools.count is atomic under the GIL
+        self._clock = itertools.count(1)
+
+    def _stripe(self, mcp_id):
+        return self._stripes[hash(mcp_id) % len(self._stripes)]
+
+    def _acquire(self, value):
+        """Shared snapshot for `value`: a private copy, reused by every context with equal content."""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        key = hashlib.blake2b(blob, digest_size=16).digest()
+        with self._lock:
+            snap = self._snapshots.get(key)
+            if snap is None:
+                snap = self._snapshots[key] = _Snapshot(key, pickle.loads(blob), len(blob))
+                self._bytes += snap.size
+            snap.refs += 1
+        return snap
+
+    def _release(self, snaps):
+        with self._lock:
+            for snap in snaps:
+                snap.refs -= 1
+                if snap.refs <= 0 and self._snapshots.pop(snap.key, None) is not None:
+                    self._bytes -= snap.size
+
+    def _build(self, fields, created_at, snaps=None):
+        """_Entry of the context dict, its shared snapshots and its own bytes. `snaps`
+        carries over snapshots already held for fields that are not being replaced."""
+        snaps = dict(snaps or {})
+        for name in SHARED_FIELDS:
+            if name in fields:
+                snaps[name] = self._acquire(fields[name])
+        blob = pickle.dumps(fields.get("task_state"), protocol=pickle.HIGHEST_PROTOCOL)
+        context = {name: snap.value for name, snap in snaps.items()}
+        context["task_state"] = pickle.loads(blob)
+        context["created_at"] = created_at
+        return _Entry(context, snaps, len(blob))
+
+    def create(self, state, profiles, task_state, tools):
+        mcp_id = str(uuid.uuid4())
+        entry = self._build(
+            {
+                "neighborhood_state": state,
+                "user_profiles": profiles,
+                "task_state": task_state,
+                "tool_manifest": tools,
+            },
+            time.time(),
+        )
+        self._insert(mcp_id, entry)
+        return mcp_id
+
+    def update(self, mcp_id, **fields):
+        """Replace fields of a context; unchanged snapshots are reused, not copied.
+        Returns False when the context is gone."""
+        unknown = set(fields) - set(SHARED_FIELDS) - {"task_state"}
+        if unknown:
+            raise ValueError(f"unknown context fields: {', '.join(sorted(unknown))}")
+        stripe = self._stripe(mcp_id)
+        with stripe.lock:
+            old = stripe.entries.get(mcp_id)
+            if old is None or self._expired(old.context):
+                return False
+            # referenced while `old` is still stored, so a racing delete can't free them first
+            keep = {name: snap for name, snap in old.snaps.items() if name not in fields}
+            with self._lock:
+                for snap in keep.values():
+                    snap.refs += 1
+        if "task_state" not in fields:
+            fields["task_state"] = old.context["task_state"]
+        return self._insert(mcp_id, self._build(fields, old.context["created_at"], keep), old)
+
+    def get(self, mcp_id):
+        stripe = self._stripe(mcp_id)
+        with stripe.lock:
+            entry = stripe.entries.get(mcp_id)
+            if entry is None:
+                return None
+            if not self._expired(entry.context):
+                stripe.entries.move_to_end(mcp_id)
+                entry.used = next(self._clock)
+                # a new top-level dict so callers can't rebind fields of the stored context
+                return dict(entry.context)
+            del stripe.entries[mcp_id]
+        self._forget(entry)
+        return None
+
+    def delete(self, mcp_id):
+        stripe = self._stripe(mcp_id)
+        with stripe.lock:
+            entry = stripe.entries.pop(mcp_id, None)
+        if entry is not None:
+            self._forget(entry)
+        return entry is not None
+
+    def _expired(self, context, now=None):
+        return self.ttl > 0 and (now or time.time()) - context["created_at"] > self.ttl
+
+    def _insert(self, mcp_id, entry, replaces=None):
+        """Store `entry` under `mcp_id`. With `replaces`, only if that entry is still the
+        stored one (not deleted, evicted or updated meanwhile); returns whether it was stored."""
+        stripe = self._stripe(mcp_id)
+        with stripe.lock:
+            old = stripe.entries.get(mcp_id)
+            stored = replaces is None or old is replaces
+            if stored:
+                entry.used = next(self._clock)
+                stripe.entries.pop(mcp_id, None)
+                stripe.entries[mcp_id] = entry
+        if not stored:
+            self._release(entry.snaps.values())
+            return False
+        with self._lock:
+            self._count += 1
+            self._bytes += entry.size
+        if old is not None:
+            self._forget(old)
+        self._evict(mcp_id)
+        return True
+
+    def _forget(self, entry, evicted=False):
+        with self._lock:
+            self.evictions += evicted
+            self._count -= 1
+            self._bytes -= entry.size
+        self._release(entry.snaps.values())
+
+    def _over_budget(self):
+        return self._count > self.max_entries or (
+            self.max_bytes > 0 and self._bytes > self.max_bytes
+        )
+
+    @staticmethod
+    def _head(stripe, keep):
+        """(mcp_id, entry) at the LRU end of a stripe, skipping `keep`. Hold the stripe lock."""
+        for mcp_id, entry in stripe.entries.items():
+            if mcp_id != keep:
+                return mcp_id, entry
+        return None
+
+    def _oldest(self, keep):
+        """(stripe, mcp_id, entry, used) of the least recently used context over all
+        stripes, never `keep`."""
+        oldest = None
+        for stripe in self._stripes:
+            with stripe.lock:
+                head = self._head(stripe, keep)
+            if head is not None and (oldest is None or head[1].used < oldest[3]):
+                oldest = (stripe, head[0], head[1], head[1].used)
+        return oldest
+
+    def _evict(self, keep):
+        """Drop expired contexts from the stripe just written, then the least recently used
+        contexts of any stripe until within budget. `keep`, the context that was just
+        written, is never evicted."""
+        now = time.time()
+        stripe = self._stripe(keep)
+        while True:
+            with stripe.lock:
+                head = self._head(stripe, keep)
+                if head is None or not self._expired(head[1].context, now):
+                    break
+                del stripe.entries[head[0]]
+            self._forget(head[1], evicted=True)
+        while self._over_budget():
+            oldest = self._oldest(keep)
+            if oldest is None:
+                return
+            stripe, mcp_id, entry, used = oldest
+            with stripe.lock:
+                # read or replaced since it was picked: look again
+                if stripe.entries.get(mcp_id) is not entry or entry.used != used:
+                    continue
+                del stripe.entries[mcp_id]
+            self._forget(entry, evicted=True)
+
+    def purge(self):
+        """Remove every expired context (eviction otherwise only looks at LRU heads)."""
+        now = time.time()
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                expired = [
+                    (k, e) for k, e in stripe.entries.items() if self._expired(e.context, now)
+                ]
+                for mcp_id, _ in expired:
+                    del stripe.entries[mcp_id]
+            for _, entry in expired:
+                self._forget(entry)
+            removed += len(expired)
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "contexts": self._count,
+                "snapshots": len(self._snapshots),
+                "bytes": self._bytes,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, mcp_id):
+        return self.get(mcp_id) is not None
+
+
+class SharedContextStore:
+    """Context store in a SQLite file shared by every process that opens the same path.
+
+    Snapshots are content-addressed blobs written once, however many contexts or
+    processes use them. The file is read through SQLite's mmap, so all processes read the
+    same OS page cache. Each process also keeps an LRU of up to `decoded_snapshots`
+    unpickled snapshots, so a neighbourhood shared by many contexts is decoded once per
+    process rather than once per get_mcp.
+
+    Expired contexts and anything beyond `max_entries` (oldest first) are pruned every
+    `prune_every` writes, together with snapshots no context references any more.
+    """
+
+    def __init__(
+        self,
+        path=STORE_PATH,
+        max_entries=MAX_ENTRIES,
+        ttl=TTL,
+        decoded_snapshots=DECODED_SNAPSHOTS,
+        prune_every=100,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.decoded_snapshots = decoded_snapshots
+        self.prune_every = prune_every
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mcp_snapshots (
+                key BLOB PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mcp_contexts (
+                mcp_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                neighborhood_key BLOB NOT NULL,
+                profiles_key BLOB NOT NULL,
+                tools_key BLOB NOT NULL,
+                task_state BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_mcp_contexts_created ON mcp_contexts (created_at);
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def _put_snapshot(self, db, value, now):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        key = hashlib.blake2b(blob, digest_size=16).digest()
+        db.execute(
+            "INSERT OR IGNORE INTO mcp_snapshots (key, data, size, created_at) VALUES (?, ?, ?, ?)",
+            (key, blob, len(blob), now),
+        )
+        return key
+
+    def _snapshot(self, db, key):
+        value = self._decoded.get(key)
+        if value is not None:
+            self._decoded.move_to_end(key)
+            return value
+        row = db.execute("SELECT data FROM mcp_snapshots WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(f"missing snapshot {key.hex()}")
+        value = pickle.loads(row[0])
+        self._decoded[key] = value
+        while len(self._decoded) > self.decoded_snapshots:
+            self._decoded.popitem(last=False)
+        return value
+
+    def create(self, state, profiles, task_state, tools):
+        mcp_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            with db:
+                keys = [self._put_snapshot(db, value, now) for value in (state, profiles, tools)]
+                db.execute(
+                    """INSERT INTO mcp_contexts (mcp_id, created_at, updated_at, neighborhood_key, profiles_key,
+                              tools_key, task_state) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (
+                        mcp_id,
+                        now,
+                        now,
+                        *keys,
+                        pickle.dumps(task_state, protocol=pickle.HIGHEST_PROTOCOL),
+                    ),
+                )
+            self._wrote(db, now)
+        return mcp_id
+
+    def update(self, mcp_id, **fields):
+        unknown = set(fields) - set(SHARED_FIELDS) - {"task_state"}
+        if unknown:
+            raise ValueError(f"unknown context fields: {', '.join(sorted(unknown))}")
+        now = time.time()
+        columns = {
+            "neighborhood_state": "neighborhood_key",
+            "user_profiles": "profiles_key",
+            "tool_manifest": "tools_key",
+        }
+        with self._lock:
+            db = self._db()
+            with db:
+                sets, params = ["updated_at = ?"], [now]
+                for name, value in fields.items():
+                    if name == "task_state":
+                        sets.append("task_state = ?")
+                        params.append(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                    else:
+                        sets.append(f"{columns[name]} = ?")
+                        params.append(self._put_snapshot(db, value, now))
+                cur = db.execute(
+                    f"UPDATE mcp_contexts SET {', '.join(sets)} WHERE mcp_id = ? AND created_at > ?",
+                    params + [mcp_id, self._cutoff(now)],
+                )
+            self._wrote(db, now)
+            return cur.rowcount > 0
+
+    def get(self, mcp_id):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                """SELECT created_at, updated_at, neighborhood_key, profiles_key, tools_key, task_state
+                                FROM mcp_contexts WHERE mcp_id = ? AND created_at > ?""",
+                (mcp_id, self._cutoff(now)),
+            ).fetchone()
+            if row is None:
+                return None
+            return {
+                "neighborhood_state": self._snapshot(db, row[2]),
+                "user_profiles": self._snapshot(db, row[3]),
+                "tool_manifest": self._snapshot(db, row[4]),
+                "task_state": pickle.loads(row[5]),
+                "created_at": row[0],
+                "updated_at": row[1],
+            }
+
+    def list(self, since=0.0):
+        """(mcp_id, created_at) of live contexts created after `since`, oldest first, so a
+        process can pick up the newest snapshot versions others have published."""
+        with self._lock:
+            return (
+                self._db()
+                .execute(
+                    """SELECT mcp_id, created_at FROM mcp_contexts
+                                         WHERE created_at > ? AND created_at > ? ORDER BY created_at""",
+                    (since, self._cutoff(time.time())),
+                )
+                .fetchall()
+            )
+
+    def delete(self, mcp_id):
+        with self._lock:
+            db = self._db()
+            with db:
+                cur = db.execute("DELETE FROM mcp_contexts WHERE mcp_id = ?", (mcp_id,))
+            return cur.rowcount > 0
+
+    def _cutoff(self, now):
+        return now - self.ttl if self.ttl > 0 else float("-inf")
+
+    def _wrote(self, db, now):
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self._prune(db, now)
+
+    def _prune(self, db, now):
+        with db:
+            db.execute("DELETE FROM mcp_contexts WHERE created_at <= ?", (self._cutoff(now),))
+            db.execute(
+                """
+            DELETE FROM mcp_contexts WHERE mcp_id IN (
+                SELECT mcp_id FROM mcp_contexts ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )""",
+                (self.max_entries,),
+            )
+            db.execute("""
+            DELETE FROM mcp_snapshots WHERE key NOT IN (
+                SELECT neighborhood_key FROM mcp_contexts UNION SELECT profiles_key FROM mcp_contexts
+                UNION SELECT tools_key FROM mcp_contexts
+            )""")
+
+    def purge(self):
+        """Prune expired/excess contexts and unreferenced snapshots now."""
+        with self._lock:
+            self._prune(self._db(), time.time())
+
+    def stats(self):
+        with self._lock:
+            db = self._db()
+            contexts = db.execute("SELECT COUNT(*) FROM mcp_contexts").fetchone()[0]
+            snapshots, size = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM mcp_snapshots"
+            ).fetchone()
+            return {
+                "contexts": contexts,
+                "snapshots": snapshots,
+                "bytes": size,
+                "decoded": len(self._decoded),
+            }
+
+    def close(self):
+        with self._lock:
+            self._decoded.clear()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __len__(self):
+        return self.stats()["contexts"]
+
+    def __contains__(self, mcp_id):
+        return self.get(mcp_id) is not None
+
+
+MCP_STORE = SharedContextStore() if BACKEND == "sqlite" else ContextStore()
+
 
 def create_mcp(state, profiles, task_state, tools):
-    mcp_id = str(uuid.uuid4())
-    with _LOCK:
-        MCP_STORE[mcp_id] = {'neighborhood_state':state, 'user_profiles':profiles, 'task_state':task_state, 'tool_manifest':tools, 'created_at':time.time()}
-    return mcp_id
+    return MCP_STORE.create(state, profiles, task_state, tools)
+
 
 def get_mcp(mcp_id):
-    with _LOCK:
-        return MCP_STORE.get(mcp_id)
+    return MCP_STORE.get(mcp_id)
+
+
+def update_mcp(mcp_id, **fields):
+    return MCP_STORE.update(mcp_id, **fields)
+
 
+def delete_mcp(mcp_id):
+    return MCP_STORE.delete(mcp_id)
@@ -0,0 +1,98 @@
+# Wire formats shared by mcp_client and mcp_server.
+#
+# Framing (negotiated per connection with {'cmd': 'negotiate', 'framing': ...}):
+#   json    - one JSON document per line (default, easy to debug by hand)
+#   msgpack - 4-byte big-endian length prefix followed by a msgpack body
+#
+# Payload layout (per request, {'layout': ...}):
+#   rows     - data is a list of dicts (default)
+#   columnar - data is a dict of parallel lists, so keys are not repeated per record
+import asyncio
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_HEADER = struct.Struct(">I")
+
+
+def available_framings():
+    return ["json", "msgpack"] if msgpack is not None else ["json"]
+
+
+def encode(msg, framing="json"):
+    if framing == "msgpack":
+        body = msgpack.packb(msg, use_bin_type=True)
+        return _HEADER.pack(len(body)) + body
+    return json.dumps(msg).encode("utf-8") + b"\n"
+
+
+def _decode_json_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def read_message(fp, framing="json"):
+    """Read one message from a binary file object. Returns None at EOF; raises ValueError
+    for a line that is not valid JSON."""
+    if framing == "msgpack":
+        header = fp.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        body = fp.read(_HEADER.unpack(header)[0])
+        return msgpack.unpackb(body, raw=False)
+    while True:
+        line = fp.readline()
+        if not line:
+            return None
+        msg = _decode_json_line(line)
+        if msg is not None:
+            return msg
+
+
+async def aread_message(reader, framing="json"):
+    """Async variant of read_message for anything with readline()/readexactly() coroutines."""
+    if framing == "msgpack":
+        try:
+            header = await reader.readexactly(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return None
+            body = await reader.readexactly(_HEADER.unpack(header)[0])
+        except asyncio.IncompleteReadError:
+            return None
+        return msgpack.unpackb(body, raw=False)
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        msg = _decode_json_line(line)
+        if msg is not None:
+            return msg
+
+
+def shape_rows(rows, columns, layout="rows"):
+    """Turn value tuples into the requested payload layout."""
+    if layout == "columnar":
+        if not rows:
+            return {name: [] for name in columns}
+        return {name: list(values) for name, values in zip(columns, zip(*rows))}
+    return [dict(zip(columns, r)) for r in rows]
+
+
+def row_count(data):
+    if isinstance(data, dict):
+        return len(next(iter(data.values()), []))
+    return len(data)
+
+
+def from_columns(data):
+    """Columnar payload -> list of dicts (no-op for payloads already in the rows layout)."""
+    if not isinstance(data, dict):
+        return data
+    names = list(data)
+    return [dict(zip(names, values)) for values in zip(*data.values())]
@@ -0,0 +1,223 @@
+"""OpenTelemetry tracing and metrics for the MCP server/client, agents and LLM calls.
+
+Off by default. TELEMETRY_EXPORTER selects where spans and metrics go:
+  none    - nothing is recorded; span() and the instruments are shared no-op objects (default)
+  console - human-readable JSON on stderr
+  file    - one JSON document per line appended to TELEMETRY_FILE (data/telemetry.jsonl)
+  otlp    - OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (standard OTel env vars apply)
+If the opentelemetry packages are not installed everything stays a no-op.
+
+The MCP server is a stdio subprocess: its stdout is the protocol pipe and its stderr is
+logged as errors by the client, so it always exports to the file (or OTLP), never to the
+console. Trace context crosses the pipe in the request's 'trace' field (see inject/extract).
+"""
+
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import (
+        ConsoleMetricExporter,
+        PeriodicExportingMetricReader,
+    )
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+except ImportError:
+    trace = None
+
+EXPORTER = os.getenv("TELEMETRY_EXPORTER", "none").lower()
+TELEMETRY_FILE = os.getenv("TELEMETRY_FILE") or os.path.join(
+    os.path.dirname(__file__), "../data/telemetry.jsonl"
+)
+METRIC_INTERVAL_MS = int(os.getenv("TELEMETRY_METRIC_INTERVAL_MS", "10000"))
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NoopInstrument:
+    def record(self, value, attributes=None):
+        pass
+
+    def add(self, value, attributes=None):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_NOOP_INSTRUMENT = _NoopInstrument()
+
+_tracer = None
+_meter = None
+_providers = []
+_instruments = {}
+_lock = threading.Lock()
+_propagator = TraceContextTextMapPropagator() if trace else None
+
+
+def enabled():
+    return _tracer is not None
+
+
+def _file_out():
+    os.makedirs(os.path.dirname(os.path.abspath(TELEMETRY_FILE)), exist_ok=True)
+    # line buffered so concurrent processes append whole lines
+    return open(TELEMETRY_FILE, "a", buffering=1)
+
+
+def _exporters(exporter):
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter(), OTLPMetricExporter()
+    if exporter == "console":
+        return ConsoleSpanExporter(out=sys.stderr), ConsoleMetricExporter(out=sys.stderr)
+    out = _file_out()
+    return (
+        ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n"),
+        ConsoleMetricExporter(out=out, formatter=lambda data: data.to_json(indent=None) + "\n"),
+    )
+
+
+def setup(service_name, exporter=None):
+    """Install tracer and meter providers for this process (idempotent). Returns True
+    when telemetry is active."""
+    global _tracer, _meter
+    exporter = (exporter or EXPORTER).lower()
+    if exporter in ("", "none", "off") or trace is None:
+        if trace is None and exporter not in ("", "none", "off"):
+            logging.warning(
+                "TELEMETRY_EXPORTER=%s but opentelemetry is not installed; telemetry disabled",
+                exporter,
+            )
+        return False
+    with _lock:
+        if _tracer is not None:
+            return True
+        if exporter not in ("console", "file", "otlp"):
+            logging.warning(
+                "Unknown TELEMETRY_EXPORTER %r, writing to %s", exporter, TELEMETRY_FILE
+            )
+        span_exporter, metric_exporter = _exporters(exporter)
+        resource = Resource.create({"service.name": service_name})
+        tracer_provider = TracerProvider(resource=resource)
+        tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        meter_provider = MeterProvider(
+            resource=resource,
+            metric_readers=[
+                PeriodicExportingMetricReader(
+                    metric_exporter, export_interval_millis=METRIC_INTERVAL_MS
+                )
+            ],
+        )
+        _providers.extend([tracer_provider, meter_provider])
+        _tracer = tracer_provider.get_tracer("neighbourhood_energy_optimizer")
+        _meter = meter_provider.get_meter("neighbourhood_energy_optimizer")
+        atexit.register(shutdown)
+    return True
+
+
+def shutdown():
+    """Flush and stop the exporters (also runs at interpreter exit)."""
+    global _tracer, _meter
+    with _lock:
+        providers = list(_providers)
+        _providers.clear()
+        _tracer = _meter = None
+        _instruments.clear()
+    for provider in providers:
+        try:
+            provider.shutdown()
+        except Exception as e:
+            logging.warning("telemetry shutdown failed: %s", e)
+
+
+def span(name, attributes=None, context=None):
+    """Context manager for a span; a shared no-op object when telemetry is off."""
+    if _tracer is None:
+        return _NOOP_SPAN
+    return _tracer.start_as_current_span(name, context=context, attributes=attributes)
+
+
+def histogram(name, unit="ms", description=""):
+    return _instrument("histogram", name, unit, description)
+
+
+def counter(name, unit="1", description=""):
+    return _instrument("counter", name, unit, description)
+
+
+def _instrument(kind, name, unit, description):
+    if _meter is None:
+        return _NOOP_INSTRUMENT
+    key = (kind, name)
+    instrument = _instruments.get(key)
+    if instrument is None:
+        with _lock:
+            instrument = _instruments.get(key)
+            if instrument is None:
+                create = _meter.create_histogram if kind == "histogram" else _meter.create_counter
+                instrument = _instruments[key] = create(name, unit=unit, description=description)
+    return instrument
+
+
+class _Timed:
+    def __init__(self, name, metric, attributes):
+        self._span = span(name, attributes)
+        self._metric = metric
+        self._attributes = attributes
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self._span.__enter__()
+
+    def __exit__(self, *exc):
+        histogram(self._metric).record(
+            (time.perf_counter() - self._started) * 1000.0, self._attributes
+        )
+        return self._span.__exit__(*exc)
+
+
+def timed(name, metric, attributes=None):
+    """Span plus a duration (ms) recorded on the `metric` histogram."""
+    if _tracer is None:
+        return _NOOP_SPAN
+    return _Timed(name, metric, attributes)
+
+
+def inject():
+    """Carrier dict with the current trace context, for sending to another process."""
+    if _tracer is None:
+        return None
+    carrier = {}
+    _propagator.inject(carrier)
+    return carrier or None
+
+
+def extract(carrier):
+    """Parent context from a carrier produced by inject() (None when there is none)."""
+    if _tracer is None or not carrier:
+        return None
+    return _propagator.extract(carrier)
@@ -0,0 +1,191 @@
+"""Incremental ingestion of meter readings into the consumption table.
+
+Readings are upserted on (consumer_id, date), so re-running the same input is a no-op, and
+corrected readings replace the old values. consumer_rollup and consumer_monthly are kept
+current by the triggers in generate_mock_db.SCHEMA, which only touch the consumers whose
+rows changed; the rolling windows are refreshed after every write. Every source keeps a
+high-water mark (its latest reading date) in ingest_state. Later runs skip readings
+before that date, so a daily run only processes the new day.
+
+    python scripts/ingest.py readings.csv [--source NAME] [--full]
+    python scripts/ingest.py --mock-next-day
+"""
+
+import argparse
+import csv
+import logging
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.generate_mock_db import DB, create_db, init_schema, refresh_windows
+
+COLUMNS = ("consumer_id", "date", "daily_kwh", "uses_efficient_equipment", "produces_solar")
+
+# DO UPDATE only when something changed, so replaying a file does not fire the rollup
+# update trigger for identical rows
+SQL_UPSERT = """
+INSERT INTO consumption (consumer_id, date, daily_kwh, uses_efficient_equipment, produces_solar)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (consumer_id, date) DO UPDATE SET
+    daily_kwh = excluded.daily_kwh,
+    uses_efficient_equipment = excluded.uses_efficient_equipment,
+    produces_solar = excluded.produces_solar
+WHERE daily_kwh IS NOT excluded.daily_kwh
+   OR uses_efficient_equipment IS NOT excluded.uses_efficient_equipment
+   OR produces_solar IS NOT excluded.produces_solar
+"""
+SQL_SET_STATE = """
+INSERT INTO ingest_state (source, high_water, rows_ingested, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (source) DO UPDATE SET
+    high_water = MAX(COALESCE(high_water, ''), excluded.high_water),
+    rows_ingested = rows_ingested + excluded.rows_ingested,
+    updated_at = excluded.updated_at
+"""
+
+
+def connect(path=DB):
+    conn = sqlite3.connect(path)
+    # WAL lets the MCP server's read-only connections keep reading while we write
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    init_schema(conn)
+    return conn
+
+
+def ensure_db(path=DB):
+    """Make sure the database exists with the current schema. Existing data is kept. Only a
+    missing database is seeded with mock data. Cheap enough to call on every startup."""
+    if not os.path.exists(path):
+        logging.info("No database at %s, generating mock data", path)
+        create_db(path)
+        return
+    conn = connect(path)
+    conn.close()
+
+
+def high_water(conn, source="default"):
+    row = conn.execute("SELECT high_water FROM ingest_state WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else None
+
+
+def normalize(reading):
+    """(consumer_id, date, daily_kwh, efficient, solar) tuple from a dict or sequence."""
+    if isinstance(reading, dict):
+        reading = [reading[name] for name in COLUMNS]
+    consumer_id, day, kwh, efficient, solar = reading
+    return (
+        str(consumer_id),
+        date.fromisoformat(str(day)[:10]).isoformat(),
+        float(kwh),
+        int(_flag(efficient)),
+        int(_flag(solar)),
+    )
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+
+def ingest_readings(conn, readings, source="default", full=False):
+    """Upsert readings in one transaction and advance the source's high-water mark.
+
+    Readings dated before the current high-water mark are skipped unless full=True;
+    readings on the high-water date itself are upserted again, since that day may have
+    been partial. Returns {'read', 'skipped', 'written', 'consumers', 'high_water'}.
+    """
+    since = None if full else high_water(conn, source)
+    stats = {"read": 0, "skipped": 0, "written": 0, "consumers": 0, "high_water": since}
+    consumers = set()
+    latest = earliest_written = None
+    with conn:
+        for reading in readings:
+            row = normalize(reading)
+            stats["read"] += 1
+            if since and row[1] < since:
+                stats["skipped"] += 1
+                continue
+            # rowcount is 0 when the reading was already stored with the same values
+            if conn.execute(SQL_UPSERT, row).rowcount:
+                stats["written"] += 1
+                consumers.add(row[0])
+                if earliest_written is None or row[1] < earliest_written:
+                    earliest_written = row[1]
+            if latest is None or row[1] > latest:
+                latest = row[1]
+        if latest:
+            conn.execute(
+                SQL_SET_STATE, (source, latest, stats["written"], datetime.utcnow().isoformat())
+            )
+        if stats["written"]:
+            # consumer_monthly follows the triggers; rolling windows slide when only new days arrived
+            refresh_windows(conn, written_from=earliest_written)
+    stats["consumers"] = len(consumers)
+    stats["high_water"] = high_water(conn, source)
+    return stats
+
+
+def read_csv(path):
+    """Readings from a CSV file with a header naming the COLUMNS."""
+    with open(path, newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def mock_next_day(conn):
+    """One synthetic reading per known consumer for the day after the latest reading,
+    keeping each consumer's current usage band and flags (handy for demoing a daily run)."""
+    last = conn.execute("SELECT MAX(date) FROM consumption").fetchone()[0]
+    day = (
+        (date.fromisoformat(last) + timedelta(days=1)).isoformat()
+        if last
+        else datetime.utcnow().date().isoformat()
+    )
+    rows = conn.execute(
+        """SELECT consumer_id, kwh_sum / day_count, efficient_days > 0, solar_days > 0
+                           FROM consumer_rollup ORDER BY consumer_id"""
+    ).fetchall()
+    for consumer_id, avg_kwh, efficient, solar in rows:
+        # stay on the same side of the 4 kWh threshold so scenarios do not drift
+        low, high = (2.0, 3.9) if avg_kwh < 4 else (4.0, 12.0)
+        yield (consumer_id, day, round(random.uniform(low, high), 2), int(efficient), int(solar))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest meter readings incrementally")
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="CSV files with consumer_id,date,daily_kwh,uses_efficient_equipment,produces_solar",
+    )
+    parser.add_argument("--db", default=DB, help="database path (default: %(default)s)")
+    parser.add_argument(
+        "--source", default="default", help="name the high-water mark is tracked under"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="ignore the high-water mark and upsert everything"
+    )
+    parser.add_argument(
+        "--mock-next-day", action="store_true", help="append one synthetic day for every consumer"
+    )
+    args = parser.parse_args(argv)
+    if not args.files and not args.mock_next_day:
+        parser.error("give CSV files to ingest or --mock-next-day")
+
+    ensure_db(args.db)
+    conn = connect(args.db)
+    try:
+        if args.mock_next_day:
+            print("mock", ingest_readings(conn, list(mock_next_day(conn)), source="mock"))
+        for path in args.files:
+            print(path, ingest_readings(conn, read_csv(path), source=args.source, full=args.full))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
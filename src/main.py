@@ -1,31 +1,37 @@
-import os
-import time
-import threading
+import asyncio
 import logging
+import os
+import sys
+
 from dotenv import load_dotenv
 
-import sys
-import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from scripts.generate_mock_db import create_db
-from mcp.mcp_client import MCPClient
-from agents.energy_monitor_beeai import run_monitor
-from agents.incentives_beeai import run_incentives
 from beeai_framework.emitter.emitter import Emitter
 
+from agents.journal import RunJournal, finish_run, start_run
+from agents.pipeline import default_max_in_flight, run_complete, run_pipeline
+from agents.sharded import run_sharded
+from llm.watson_client import prewarm, response_cache
+from mcp.mcp_client import MCPClient
+from observability import telemetry
+from scripts.generate_mock_db import create_db
+from scripts.ingest import ensure_db
+
+
 # ANSI Color Codes for colorful output
 class Colors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
-    PURPLE = '\033[35m'
-    YELLOW = '\033[33m'
+    HEADER = "\033[95m"
+    OKBLUE = "\033[94m"
+    OKCYAN = "\033[96m"
+    OKGREEN = "\033[92m"
+    WARNING = "\033[93m"
+    FAIL = "\033[91m"
+    ENDC = "\033[0m"
+    BOLD = "\033[1m"
+    UNDERLINE = "\033[4m"
+    PURPLE = "\033[35m"
+    YELLOW = "\033[33m"
+
 
 def print_colored(text, color=Colors.ENDC):
     """Print text with color"""
@@ -35,19 +41,53 @@ def print_colored(text, color=Colors.ENDC):
         # Fallback for encoding issues
         print(f"{color}{text.encode('ascii', 'ignore').decode('ascii')}{Colors.ENDC}")
 
+
 def main():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
     load_dotenv()
+    # spans/metrics for MCP, agents and LLM calls; no-op unless TELEMETRY_EXPORTER is set
+    telemetry.setup("energy-optimizer")
 
-    print_colored("*** Neighbourhood Energy Optimizer - Starting System ***", Colors.HEADER + Colors.BOLD)
+    print_colored(
+        "*** Neighbourhood Energy Optimizer - Starting System ***", Colors.HEADER + Colors.BOLD
+    )
     print_colored("=" * 70, Colors.OKBLUE)
 
-    # Fresh mock DB for each run
-    create_db()
+    # Keep the existing data (new readings arrive through scripts/ingest.py); only a
+    # missing database is seeded. REGENERATE_DB=true restores the old fresh-mock-data run.
+    if os.getenv("REGENERATE_DB", "false").lower() == "true":
+        create_db()
+    else:
+        ensure_db()
+
+    # Optional overall deadline in seconds (unset/0 = run until every consumer is processed)
+    timeout = float(os.getenv("PIPELINE_TIMEOUT", "0")) or None
+    max_in_flight = int(os.getenv("PIPELINE_MAX_IN_FLIGHT", "0")) or default_max_in_flight()
+    # >1 hash-partitions consumers across that many worker processes
+    workers = int(os.getenv("PIPELINE_WORKERS", "1"))
+    # Journal deliveries so an interrupted run resumes (RUN_ID picks a run explicitly;
+    # otherwise the latest unfinished run is resumed unless RESUME_RUNS=false)
+    run_id = None
+    if os.getenv("RUN_JOURNAL", "true").lower() == "true":
+        run_id, resumed = start_run(
+            os.getenv("RUN_ID") or None,
+            shard_count=max(1, workers),
+            resume=os.getenv("RESUME_RUNS", "true").lower() == "true",
+        )
+        print_colored(f"> {'Resuming' if resumed else 'Starting'} run {run_id}", Colors.OKCYAN)
+    if workers > 1:
+        run_sharded_main(workers, max_in_flight, timeout, run_id)
+        return
+
+    # Authenticate with the LLM provider in the background while the rest starts up
+    prewarm()
 
     # start MCP client (spawns mcp_server as subprocess)
     print_colored("> Initializing MCP client...", Colors.OKCYAN)
-    mcp = MCPClient(server_py=os.path.join(os.path.dirname(__file__), '../mcp/mcp_server.py'))
+    mcp = MCPClient(server_py=os.path.join(os.path.dirname(__file__), "../mcp/mcp_server.py"))
+    journal = RunJournal(run_id) if run_id else None
     print_colored("> MCP client initialized!", Colors.OKGREEN)
 
     # Create shared emitter for inter-agent communication
@@ -55,35 +95,113 @@ def main():
     shared_emitter = Emitter()
     print_colored("> Agent communication ready!", Colors.OKGREEN)
 
-    # Add completion tracking
-    completion_event = threading.Event()
-    
-    print_colored("\n*** Starting BeeAI agents (monitor + incentives)... ***", Colors.HEADER + Colors.BOLD)
-    print_colored("> Agents will process all 50 consumers sequentially...", Colors.WARNING)
+    print_colored(
+        "\n*** Starting BeeAI agents (monitor + incentives)... ***", Colors.HEADER + Colors.BOLD
+    )
+    print_colored(
+        f"> Agents will stream consumers with up to {max_in_flight} in flight...", Colors.WARNING
+    )
     print_colored("=" * 70, Colors.OKBLUE)
-    
-    t1 = threading.Thread(target=run_monitor, args=(mcp, None, shared_emitter, completion_event), daemon=True)
-    t2 = threading.Thread(target=run_incentives, args=(mcp, shared_emitter, completion_event), daemon=True)
-    t1.start()
-    t2.start()
 
     try:
-        # Wait for completion or timeout after 60 seconds
-        completion_event.wait(timeout=60)
-        if completion_event.is_set():
-            print_colored("\n" + "=" * 70, Colors.OKBLUE)
-            print_colored("*** All 50 consumers processed successfully! ***", Colors.OKGREEN + Colors.BOLD)
-            print_colored("> System shutdown complete!", Colors.OKGREEN)
+        monitor, incentives = asyncio.run(
+            asyncio.wait_for(
+                run_pipeline(mcp, shared_emitter, max_in_flight, journal=journal), timeout
+            )
+        )
+        print_colored("\n" + "=" * 70, Colors.OKBLUE)
+        if run_complete(monitor, incentives):
+            if journal:
+                journal.flush()
+                finish_run(run_id)
+            print_colored(
+                f"*** All {monitor.total_consumers} consumers processed successfully! ***",
+                Colors.OKGREEN + Colors.BOLD,
+            )
         else:
-            print_colored("\n" + "=" * 70, Colors.OKBLUE)
-            print_colored("*** Timeout reached. Shutting down... ***", Colors.WARNING + Colors.BOLD)
+            delivered = monitor.resumed + monitor.processed_consumers - incentives.failed
+            print_colored(
+                f"*** Run incomplete: {delivered} of {monitor.total_consumers} consumers delivered, {incentives.failed} failed ***",
+                Colors.FAIL + Colors.BOLD,
+            )
+            if monitor.error is not None:
+                print_colored(f"> MCP error: {monitor.error}", Colors.FAIL)
+            _left_open(run_id)
+        print_colored("> System shutdown complete!", Colors.OKGREEN)
+    except asyncio.TimeoutError:
+        print_colored("\n" + "=" * 70, Colors.OKBLUE)
+        print_colored("*** Timeout reached. Shutting down... ***", Colors.WARNING + Colors.BOLD)
     except KeyboardInterrupt:
         print_colored("\n" + "=" * 70, Colors.OKBLUE)
         print_colored("*** Manual shutdown requested... ***", Colors.FAIL + Colors.BOLD)
     finally:
         mcp.close()
+        if journal:
+            # the checkpoint an interrupted run resumes from
+            journal.close()
+        if response_cache is not None:
+            logging.info("LLM response cache: %s", response_cache.stats())
+            response_cache.close()
+        telemetry.shutdown()
+        print_colored("> Goodbye!", Colors.HEADER)
+
+
+def _left_open(run_id):
+    if run_id:
+        print_colored(
+            f"> Run {run_id} is left open; start again to resume it (and retry failed deliveries)",
+            Colors.WARNING,
+        )
+
+
+def run_sharded_main(workers, max_in_flight, timeout, run_id=None):
+    """Sharded mode: one process per shard, each with its own MCP server and agents"""
+    print_colored(
+        f"\n*** Starting {workers} sharded workers (monitor + incentives each)... ***",
+        Colors.HEADER + Colors.BOLD,
+    )
+    print_colored(
+        "> Consumers are partitioned by consumer_id hash; each shard writes its letters to a file",
+        Colors.WARNING,
+    )
+    print_colored("=" * 70, Colors.OKBLUE)
+    try:
+        merged, summaries = run_sharded(workers, max_in_flight, timeout, run_id=run_id)
+        if run_id and merged["complete"]:
+            finish_run(run_id)
+        for summary in summaries:
+            resumed = f" (resumed after {summary['resumed']})" if summary.get("resumed") else ""
+            print_colored(
+                f"  [Shard {summary['shard']}] {summary['processed_consumers']}/{summary['total_consumers']} consumers in {summary['elapsed']}s{resumed} -> {summary['output']}",
+                Colors.OKCYAN,
+            )
+        print_colored("\n" + "=" * 70, Colors.OKBLUE)
+        for scenario, n in merged["scenarios"].items():
+            print_colored(f"  {scenario}: {n}", Colors.OKGREEN)
+        if merged["complete"]:
+            print_colored(
+                f"*** All {merged['total_consumers']} consumers processed successfully by {workers} workers! ***",
+                Colors.OKGREEN + Colors.BOLD,
+            )
+        else:
+            for summary in summaries:
+                if summary["error"]:
+                    print_colored(
+                        f"> [Shard {summary['shard']}] MCP error: {summary['error']}", Colors.FAIL
+                    )
+            print_colored(
+                f"*** Run incomplete: {merged['failed']} failed deliveries across {workers} workers ***",
+                Colors.FAIL + Colors.BOLD,
+            )
+            _left_open(run_id)
+    except (asyncio.TimeoutError, TimeoutError):
+        print_colored("*** Timeout reached. Shutting down... ***", Colors.WARNING + Colors.BOLD)
+    except KeyboardInterrupt:
+        print_colored("*** Manual shutdown requested... ***", Colors.FAIL + Colors.BOLD)
+    finally:
+        telemetry.shutdown()
         print_colored("> Goodbye!", Colors.HEADER)
 
 
-if __name__ == '__main__':
+if __name__ == "__main__":
     main()
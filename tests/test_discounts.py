@@ -0,0 +1,72 @@
+import itertools
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from agents import discounts
+from agents.consumers import ConsumerTable
+
+# both sides of the threshold, including exactly 4.0 (high usage) and values a float step away
+AVG_KWH = [0.0, 1.5, 3.99, np.nextafter(4.0, 0.0), 4.0, np.nextafter(4.0, 5.0), 4.01, 12.0]
+
+
+def _consumers():
+    rows = list(itertools.product(AVG_KWH, (False, True), (False, True)))
+    avg_kwh, efficient, solar = (np.array(column) for column in zip(*rows))
+    return rows, avg_kwh, efficient, solar
+
+
+def test_classify_at_threshold_is_high_usage():
+    assert discounts.USAGE_THRESHOLD_KWH == 4.0
+    assert discounts.classify(4.0, True, True) == "high_usage"
+    assert discounts.classify(np.nextafter(4.0, 0.0), True, True) == "10_percent"
+
+
+def test_classify_batch_matches_classify():
+    rows, avg_kwh, efficient, solar = _consumers()
+    codes, counts = discounts.classify_batch(avg_kwh, efficient, solar)
+    expected = [discounts.classify(*row) for row in rows]
+    assert codes.dtype == np.int8
+    assert [discounts.SCENARIOS[code] for code in codes] == expected
+    assert counts == {name: Counter(expected)[name] for name in discounts.SCENARIOS}
+
+
+def test_classify_variants_match_classify_per_threshold():
+    rows, avg_kwh, efficient, solar = _consumers()
+    thresholds = [3.99, 4.0, np.nextafter(4.0, 5.0), 4.5]
+    variants = discounts.classify_variants(avg_kwh, efficient, solar, thresholds)
+    assert variants.shape == (len(thresholds), len(discounts.SCENARIOS))
+    for threshold, counts in zip(thresholds, variants):
+        expected = Counter(discounts.classify(*row, threshold) for row in rows)
+        assert counts.tolist() == [expected[name] for name in discounts.SCENARIOS]
+
+
+def test_discount_percents_follow_tiers():
+    rows, avg_kwh, efficient, solar = _consumers()
+    codes = discounts.classify_codes(avg_kwh, efficient, solar)
+    expected = [discounts.DISCOUNT_TIERS[discounts.classify(*row)] for row in rows]
+    assert discounts.discount_percents(codes).tolist() == expected
+    high = [1 if discounts.classify(*row) == "high_usage" else 0 for row in rows]
+    assert discounts.discount_percents(codes, {"high_usage": 1}).tolist() == high
+
+
+def test_consumer_columns_accepts_every_shape():
+    rows, avg_kwh, efficient, solar = _consumers()
+    ids = [f"consumer_{i:06d}" for i in range(len(rows))]
+    dicts = [
+        {"consumer_id": c, "avg_kwh": a, "uses_efficient_equipment": e, "produces_solar": s}
+        for c, (a, e, s) in zip(ids, rows)
+    ]
+    columnar = {
+        "consumer_id": ids,
+        "avg_kwh": avg_kwh.tolist(),
+        "uses_efficient_equipment": efficient.tolist(),
+        "produces_solar": solar.tolist(),
+    }
+    for consumers in (dicts, columnar, ConsumerTable.from_payload(columnar)):
+        columns = discounts.consumer_columns(consumers)
+        for got, want in zip(columns, (avg_kwh, efficient, solar)):
+            np.testing.assert_array_equal(got, want)
@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp.store import ContextStore
+
+
+def _create(store, i):
+    return store.create({"homes": 3}, {}, {"step": i}, [])
+
+
+def test_new_id_survives_at_capacity():
+    store = ContextStore(max_entries=10, ttl=0)
+    for i in range(1000):
+        mcp_id = _create(store, i)
+        assert store.get(mcp_id) is not None
+    assert len(store) == 10
+
+
+def test_oldest_global_entry_goes_first():
+    store = ContextStore(max_entries=3, ttl=0, stripes=16)
+    first, second, third = (_create(store, i) for i in range(3))
+    store.get(first)
+    fourth = _create(store, 3)
+    assert second not in store
+    assert all(mcp_id in store for mcp_id in (first, third, fourth))
+
+
+def test_lru_order_across_stripes():
+    store = ContextStore(max_entries=50, ttl=0, stripes=8)
+    ids = [_create(store, i) for i in range(50)]
+    for mcp_id in ids[:25]:
+        store.get(mcp_id)
+    newer = [_create(store, i) for i in range(25)]
+    assert all(mcp_id in store for mcp_id in ids[:25] + newer)
+    assert not any(mcp_id in store for mcp_id in ids[25:])
+
+
+def test_update_keeps_context_at_capacity():
+    store = ContextStore(max_entries=2, ttl=0)
+    mcp_id = _create(store, 0)
+    _create(store, 1)
+    assert store.update(mcp_id, task_state={"step": 2})
+    assert store.get(mcp_id)["task_state"] == {"step": 2}
+
+
+def test_update_racing_delete_does_not_restore_context():
+    class DeleteDuringBuild(ContextStore):
+        def _build(self, fields, created_at, snaps=None):
+            if snaps is not None:
+                self.delete(target)
+            return super()._build(fields, created_at, snaps)
+
+    store = DeleteDuringBuild(max_entries=10, ttl=0)
+    target = _create(store, 0)
+    assert not store.update(target, task_state={"step": 1})
+    assert target not in store
+    assert store.stats() == {"contexts": 0, "snapshots": 0, "bytes": 0, "evictions": 0}
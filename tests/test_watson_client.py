@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm import watson_client
+from llm.cache import ResponseCache
+
+
+def test_get_client_races_reset_client(monkeypatch):
+    monkeypatch.setattr(watson_client, "USE_WATSONX", True)
+    monkeypatch.setattr(watson_client, "WATSONX_CLIENT_TTL", 1000.0)
+    monkeypatch.setattr(watson_client, "_build_client", object)
+    monkeypatch.setattr(watson_client, "_client_state", None)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    stop = time.monotonic() + 1.0
+    results, errors = [], []
+
+    def getter():
+        while time.monotonic() < stop:
+            try:
+                results.append(watson_client.get_client())
+            except Exception as e:
+                errors.append(e)
+
+    def resetter():
+        while time.monotonic() < stop:
+            watson_client.reset_client()
+
+    threads = [threading.Thread(target=getter) for _ in range(4)]
+    threads.append(threading.Thread(target=resetter))
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert not errors
+    assert None not in results
+
+
+def test_batch_cache_keys_on_unit_and_token_budget(monkeypatch, tmp_path):
+    calls = []
+
+    def generate(prompt, params, items=1):
+        calls.append(params["max_new_tokens"])
+        sections = watson_client._split_sections(prompt, watson_client._BATCH_ITEM_RE)
+        text = "\n".join(
+            watson_client.BATCH_OUTPUT_MARKER.format(key=key) + "\nDear " + key for key in sections
+        )
+        return {"results": [{"generated_text": text}]}
+
+    monkeypatch.setattr(watson_client, "response_cache", ResponseCache(str(tmp_path / "c.db")))
+    monkeypatch.setattr(watson_client, "_cache_active", lambda: True)
+    monkeypatch.setattr(watson_client, "_generate", generate)
+    items = [("c1", "uses 5 kWh"), ("c2", "uses 3 kWh")]
+    watson_client.generate_batch("Write.", items, tokens_per_item=100)
+    watson_client.generate_batch("Write.", items, tokens_per_item=100)
+    assert calls == [200]
+    watson_client.generate_batch("Write.", items, tokens_per_item=300)
+    watson_client.generate_batch("Write.", items, unit="paragraph", tokens_per_item=300)
+    assert calls == [200, 600, 600]